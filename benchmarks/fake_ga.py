@@ -0,0 +1,65 @@
+# In-process stand-in for the Reporting API v4 service object returned by
+# GoogleAnalyticsHook.get_service_object. It answers reports().batchGet()
+# with deterministic, paginated rows shaped like real GA responses, so the GA
+# operators can be benchmarked without network access or quota.
+
+import random
+
+COUNTRIES = ['United States', 'India', 'Germany', 'Brazil', 'France', 'Japan', 'Kuwait', 'Canada']
+DEVICES = ['desktop', 'mobile', 'tablet']
+SOURCES = ['google', '(direct)', 'facebook.com', 'bing', 'newsletter', 't.co']
+
+DIMENSIONS = [{'name': 'ga:date'}, {'name': 'ga:country'}, {'name': 'ga:deviceCategory'}, {'name': 'ga:source'}]
+METRICS = [{'expression': 'ga:sessions'}, {'expression': 'ga:users'}, {'expression': 'ga:bounceRate'}]
+
+
+class _Request(object):
+
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self, *args, **kwargs):
+        return self.response
+
+
+class _Reports(object):
+
+    def __init__(self, total_rows):
+        self.total_rows = total_rows
+
+    def page(self, request):
+        start = int(request.get('pageToken') or 0)
+        size = int(request.get('pageSize') or 1000)
+        end = min(start + size, self.total_rows)
+        rng = random.Random(start)
+        day = request['dateRanges'][0]['startDate'].replace('-', '')
+        rows = [{'dimensions': [day, rng.choice(COUNTRIES), rng.choice(DEVICES), rng.choice(SOURCES)],
+                 'metrics': [{'values': [str(rng.randint(1, 5000)), str(rng.randint(1, 4000)),
+                                         '%.2f' % rng.uniform(0, 100)]}]}
+                for _ in range(start, end)]
+        report = {
+            'columnHeader': {
+                'dimensions': [dimension['name'] for dimension in request['dimensions']],
+                'metricHeader': {'metricHeaderEntries': [
+                    {'name': metric['expression'], 'type': 'INTEGER'} for metric in request['metrics']]},
+            },
+            'data': {'rows': rows, 'rowCount': self.total_rows},
+        }
+        if end < self.total_rows:
+            report['nextPageToken'] = str(end)
+        return report
+
+    def batchGet(self, body):
+        return _Request({'reports': [self.page(request) for request in body['reportRequests']]})
+
+
+class FakeAnalyticsService(object):
+    """
+    Answers every report request with total_rows rows.
+    """
+
+    def __init__(self, total_rows):
+        self._reports = _Reports(total_rows)
+
+    def reports(self):
+        return self._reports
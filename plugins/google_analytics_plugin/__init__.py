@@ -5,14 +5,16 @@ from google_analytics_plugin.hooks.google_analytics_hook import GoogleAnalyticsH
 from google_analytics_plugin.operators.ga_mysql_operator import GoogleAnalyticsReportingToMySqlOperator
 from google_analytics_plugin.operators.mysql_query_operator import MySqlQueryOperator
 from google_analytics_plugin.operators.mysql_to_csv_operator import MySqlToCsvOperator 
+from google_analytics_plugin.operators.mysql_to_parquet_operator import MySqlToParquetOperator
 from google_analytics_plugin.operators.mysql_to_mysql_operator import MySqlToMySqlOperator
 from google_analytics_plugin.operators.mysql_to_psql_operator import MySqlToPSqlOperator
+from google_analytics_plugin.operators.mysql_to_psql_replication_operator import MySqlToPSqlReplicationOperator
 
 class GoogleAnalyticsPlugin(AirflowPlugin):
     name = "google_analytics_plugin"
     hooks = [GoogleAnalyticsHook, MySqlHook, PSqlHook]
-    operators = [GoogleAnalyticsReportingToMySqlOperator, MySqlQueryOperator, MySqlToCsvOperator, \
-                 MySqlToMySqlOperator, MySqlToPSqlOperator]
+    operators = [GoogleAnalyticsReportingToMySqlOperator, MySqlQueryOperator, MySqlToCsvOperator, MySqlToParquetOperator, \
+                 MySqlToMySqlOperator, MySqlToPSqlOperator, MySqlToPSqlReplicationOperator]
     executors = []
     macros = []
     admin_views = []
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# Columnar helpers built on pyarrow (>= 11.0, the first release with the
+# quoting_style of csv.WriteOptions):
+#  - typed arrow schemas from MySQLdb cursor descriptions,
+#  - row batches to arrow RecordBatches,
+#  - PostgreSQL column types of arrow types,
+#  - RecordBatches to PostgreSQL COPY payloads. Batches made only of
+#    fixed-width, null-free columns are encoded in COPY binary format with
+#    numpy, everything else as CSV through arrow's C++ writer, so no python
+#    object is created per cell on the way to postgres.
+#
+
+import io
+import struct
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from MySQLdb.constants import FIELD_TYPE, FLAG
+
+
+_MYSQL_TYPES = {
+    FIELD_TYPE.TINY: pa.int16(),
+    FIELD_TYPE.SHORT: pa.int32(),
+    FIELD_TYPE.INT24: pa.int32(),
+    FIELD_TYPE.LONG: pa.int64(),
+    FIELD_TYPE.LONGLONG: pa.int64(),
+    FIELD_TYPE.YEAR: pa.int16(),
+    FIELD_TYPE.FLOAT: pa.float64(),
+    FIELD_TYPE.DOUBLE: pa.float64(),
+    FIELD_TYPE.DATE: pa.date32(),
+    FIELD_TYPE.NEWDATE: pa.date32(),
+    FIELD_TYPE.DATETIME: pa.timestamp('us'),
+    FIELD_TYPE.TIMESTAMP: pa.timestamp('us'),
+    FIELD_TYPE.TIME: pa.duration('us'),
+    FIELD_TYPE.BIT: pa.binary(),
+    FIELD_TYPE.NULL: pa.null(),
+}
+
+# Unsigned types whose range does not fit the signed type above.
+_MYSQL_UNSIGNED_TYPES = {
+    FIELD_TYPE.LONGLONG: pa.uint64(),
+}
+
+_DECIMAL_TYPES = (FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL)
+
+# postgres type -> (arrow type to cast to, big-endian numpy dtype, offset to subtract)
+_PG_EPOCH_DAYS = 10957
+_PG_EPOCH_US = _PG_EPOCH_DAYS * 86400 * 1000000
+_PG_BINARY_TYPES = {
+    'smallint': (pa.int16(), '>i2', 0),
+    'integer': (pa.int32(), '>i4', 0),
+    'bigint': (pa.int64(), '>i8', 0),
+    'real': (pa.float32(), '>f4', 0),
+    'double precision': (pa.float64(), '>f8', 0),
+    'boolean': (pa.bool_(), 'u1', 0),
+    'date': (pa.int32(), '>i4', _PG_EPOCH_DAYS),
+    'timestamp without time zone': (pa.int64(), '>i8', _PG_EPOCH_US),
+}
+
+_PG_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_PG_BINARY_TRAILER = struct.pack('>h', -1)
+
+
+def schema_from_description(description, sample_rows=(), flags=None):
+    """
+    Builds an arrow schema from a MySQLdb cursor description.
+    Character and blob columns share type codes with their binary variants,
+    they are resolved from the first non-NULL value in sample_rows.
+    :param description: cursor.description
+    :param sample_rows: first rows of the result
+    :param flags: cursor.description_flags, UNSIGNED BIGINT columns are
+                  typed uint64 when given and int64 otherwise
+    :rtype pyarrow.Schema
+    """
+    fields = []
+    for index, col in enumerate(description):
+        name, type_code, precision, scale = col[0], col[1], col[4], col[5]
+        if flags and flags[index] & FLAG.UNSIGNED and type_code in _MYSQL_UNSIGNED_TYPES:
+            arrow_type = _MYSQL_UNSIGNED_TYPES[type_code]
+        elif type_code in _MYSQL_TYPES:
+            arrow_type = _MYSQL_TYPES[type_code]
+        elif type_code in _DECIMAL_TYPES:
+            arrow_type = pa.decimal128(min(max(precision or 38, 1), 38), scale or 0)
+        else:
+            sample = next((row[index] for row in sample_rows if row[index] is not None), None)
+            arrow_type = pa.binary() if isinstance(sample, (bytes, bytearray)) else pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def pg_type(arrow_type):
+    """
+    Returns the postgres column type storing arrow_type, text for the types
+    without a closer match.
+    """
+    if pa.types.is_boolean(arrow_type):
+        return 'boolean'
+    if pa.types.is_integer(arrow_type):
+        bits = arrow_type.bit_width + (1 if pa.types.is_unsigned_integer(arrow_type) else 0)
+        if bits <= 16:
+            return 'smallint'
+        if bits <= 32:
+            return 'integer'
+        return 'bigint' if bits <= 64 else 'numeric(20)'
+    if pa.types.is_floating(arrow_type):
+        return 'double precision' if arrow_type.bit_width == 64 else 'real'
+    if pa.types.is_decimal(arrow_type):
+        return 'numeric({0},{1})'.format(arrow_type.precision, arrow_type.scale)
+    if pa.types.is_date(arrow_type):
+        return 'date'
+    if pa.types.is_timestamp(arrow_type):
+        return 'timestamp with time zone' if arrow_type.tz else 'timestamp without time zone'
+    if pa.types.is_duration(arrow_type):
+        # MySQL TIME spans +-838 hours, more than a postgres time.
+        return 'interval'
+    if pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        return 'bytea'
+    return 'text'
+
+
+def text_durations(batch):
+    """
+    Replaces the duration columns of batch by their postgres interval text,
+    e.g. '3600000000 microseconds'.
+    """
+    if not any(pa.types.is_duration(column.type) for column in batch.columns):
+        return batch
+    columns = []
+    for column in batch.columns:
+        if pa.types.is_duration(column.type):
+            micros = pc.cast(column.cast(pa.duration('us')).cast(pa.int64()), pa.string())
+            column = pc.binary_join_element_wise(micros, pa.scalar(' microseconds'), '')
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
+
+def rows_to_record_batch(rows, schema):
+    """
+    Converts a sequence of row tuples into a RecordBatch of schema.
+    """
+    if not rows:
+        return pa.RecordBatch.from_arrays([pa.array([], type=field.type) for field in schema], schema=schema)
+    columns = zip(*rows)
+    return pa.RecordBatch.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                                      schema=schema)
+
+
+def _binary_compatible(arrow_type, pg_type):
+    if pg_type == 'date':
+        return pa.types.is_date32(arrow_type)
+    if pg_type == 'timestamp without time zone':
+        return pa.types.is_timestamp(arrow_type) and arrow_type.tz is None
+    if pg_type == 'boolean':
+        return pa.types.is_boolean(arrow_type)
+    if pg_type in ('smallint', 'integer', 'bigint'):
+        return pa.types.is_integer(arrow_type)
+    return pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type)
+
+
+def pg_binary_payload(batch, pg_types):
+    """
+    Encodes batch in COPY binary format, or returns None when a column has
+    NULLs, a target type that is not fixed-width or values that do not fit it.
+    :param batch: RecordBatch in target column order
+    :param pg_types: postgres data_type of each column
+    :rtype bytes
+    """
+    layout = []
+    for column, pg_type in zip(batch.columns, pg_types):
+        if pg_type not in _PG_BINARY_TYPES or column.null_count or not _binary_compatible(column.type, pg_type):
+            return None
+        layout.append(_PG_BINARY_TYPES[pg_type])
+
+    fields = [('count', '>i2')]
+    for index, (arrow_type, dtype, offset) in enumerate(layout):
+        fields.append(('len%d' % index, '>i4'))
+        fields.append(('val%d' % index, dtype))
+    tuples = np.empty(batch.num_rows, dtype=fields)
+    tuples['count'] = batch.num_columns
+    for index, (column, (arrow_type, dtype, offset)) in enumerate(zip(batch.columns, layout)):
+        if pa.types.is_timestamp(column.type):
+            column = column.cast(pa.timestamp('us')).view(pa.int64())
+        elif pa.types.is_date32(column.type):
+            column = column.view(pa.int32())
+        try:
+            values = pc.cast(column, arrow_type).to_numpy(zero_copy_only=False)
+        except pa.ArrowInvalid:
+            return None
+        tuples['len%d' % index] = np.dtype(dtype).itemsize
+        tuples['val%d' % index] = values - offset if offset else values
+    return _PG_BINARY_HEADER + tuples.tobytes() + _PG_BINARY_TRAILER
+
+
+def csv_payload(batch):
+    """
+    Encodes batch as headerless CSV for COPY ... (FORMAT csv): NULLs are
+    empty unquoted fields, every other value is quoted, durations are written
+    as intervals. Returns None when a column type has no CSV text form
+    postgres could parse (binary).
+    :rtype bytes
+    """
+    for column in batch.columns:
+        if pa.types.is_binary(column.type):
+            return None
+    batch = text_durations(batch)
+    buffer = io.BytesIO()
+    pa_csv.write_csv(batch, buffer, write_options=pa_csv.WriteOptions(include_header=False,
+                                                                           quoting_style='all_valid'))
+    return buffer.getvalue()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Insertion method for pandas to_sql(method=...) that writes rows as multi-row
+# INSERT statements in batches bounded by row count and estimated size.
+# Postgres batches go through psycopg2.extras.execute_values, MySQL batches
+# through MySQLdb executemany, which rewrites them into multi-row INSERTs.
+# It only applies to the to_sql calls it is passed to.
+#
+
+from contextlib import closing
+
+
+def _row_bytes(row):
+    return sum(len(value) if isinstance(value, (str, bytes)) else 8 for value in row)
+
+
+class BatchedInsert(object):
+    """
+    pandas to_sql insertion method, see
+    https://pandas.pydata.org/pandas-docs/stable/user_guide/io.html#io-sql-method
+    :param max_rows: maximum rows per INSERT statement
+    :type max_rows: int
+    :param max_bytes: maximum estimated payload per INSERT statement
+    :type max_bytes: int
+    """
+
+    def __init__(self, max_rows=1000, max_bytes=4 * 1024 * 1024):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+
+    def batches(self, data_iter):
+        batch = []
+        size = 0
+        for row in data_iter:
+            batch.append(row)
+            size += _row_bytes(row)
+            if len(batch) >= self.max_rows or size >= self.max_bytes:
+                yield batch
+                batch = []
+                size = 0
+        if batch:
+            yield batch
+
+    def __call__(self, pd_table, conn, keys, data_iter):
+        preparer = conn.dialect.identifier_preparer
+        target = preparer.quote(pd_table.name)
+        if pd_table.schema:
+            target = preparer.quote_schema(pd_table.schema) + '.' + target
+        columns = ', '.join(preparer.quote(key) for key in keys)
+        dialect = conn.dialect.name
+
+        if dialect == 'postgresql':
+            from psycopg2.extras import execute_values
+            sql = 'INSERT INTO {0} ({1}) VALUES %s'.format(target, columns)
+            with closing(conn.connection.cursor()) as cur:
+                for batch in self.batches(data_iter):
+                    execute_values(cur, sql, batch, page_size=len(batch))
+        elif dialect == 'mysql':
+            sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(target, columns, ', '.join(['%s'] * len(keys)))
+            with closing(conn.connection.cursor()) as cur:
+                for batch in self.batches(data_iter):
+                    cur.executemany(sql, batch)
+        else:
+            for batch in self.batches(data_iter):
+                conn.execute(pd_table.table.insert(), [dict(zip(keys, row)) for row in batch])
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Process-wide registry of sqlalchemy engines shared by MySqlHook and PSqlHook.
+# Engines are keyed by (conn_id, schema, charset) so that every hook in a worker
+# process checks connections out of the same warm pool instead of building a
+# new engine per task.
+# Pool settings can be tuned per connection through the UI extras:
+#     {"pool_size": 5, "max_overflow": 10, "pool_recycle": 3600, "pool_pre_ping": true}
+# All engines are disposed when the interpreter exits.
+#
+
+import atexit
+import os
+import threading
+
+from sqlalchemy import create_engine
+
+
+DEFAULT_POOL_OPTIONS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_recycle": 3600,
+    "pool_pre_ping": True,
+}
+
+_engines = {}
+_engines_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def pool_options(extra):
+    """
+    Builds create_engine pool arguments from connection extras.
+    :param extra: connection extras (conn.extra_dejson)
+    :type extra: dict
+    :return: keyword arguments for create_engine
+    :rtype dict
+    """
+    options = dict(DEFAULT_POOL_OPTIONS)
+    for name, default in DEFAULT_POOL_OPTIONS.items():
+        if name not in extra:
+            continue
+        value = extra[name]
+        if isinstance(default, bool):
+            options[name] = str(value).lower() in ('true', '1', 'yes')
+        else:
+            options[name] = int(value)
+    return options
+
+
+def get_engine(key, uri, **engine_kwargs):
+    """
+    Returns the engine registered under key, creating it on first use.
+    An engine whose uri changed (e.g. rotated password) is disposed and rebuilt.
+    :param key: registry key, (conn_id, schema, charset)
+    :type key: tuple
+    :param uri: sqlalchemy uri of the engine
+    :type uri: string
+    :return: shared engine
+    :rtype sqlalchemy.engine.Engine
+    """
+    global _engines_pid
+    with _lock:
+        if _engines_pid != os.getpid():
+            # Forked worker: the inherited pools hold the parent's sockets,
+            # drop them without closing and start fresh in this process.
+            _engines.clear()
+            _engines_pid = os.getpid()
+        entry = _engines.get(key)
+        if entry is not None and entry[0] != uri:
+            entry[1].dispose()
+            entry = None
+        if entry is None:
+            entry = (uri, create_engine(uri, **engine_kwargs))
+            _engines[key] = entry
+        return entry[1]
+
+
+def dispose_engine(key):
+    """
+    Disposes and forgets a single engine.
+    """
+    with _lock:
+        entry = _engines.pop(key, None)
+    if entry is not None:
+        entry[1].dispose()
+
+
+def dispose_all():
+    """
+    Disposes every engine created by this process.
+    """
+    with _lock:
+        if _engines_pid != os.getpid():
+            return
+        entries = list(_engines.values())
+        _engines.clear()
+    for uri, engine in entries:
+        engine.dispose()
+
+
+atexit.register(dispose_all)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Shrinks the memory of DataFrames built from query results and GA reports:
+#  - repetitive string columns become categoricals,
+#  - integer and float columns are downcast to the smallest width that holds
+#    their values exactly,
+#  - columns of datetime.date objects are converted to datetime64 at once.
+# Downcasting and date conversion change the column types pandas to_sql
+# creates (SMALLINT, REAL, no uint64 at all), frames loaded into a database
+# only get their strings turned into categoricals.
+#
+
+import numpy as np
+import pandas as pd
+
+
+def memory_bytes(df):
+    """
+    Returns the deep memory usage of df, string payloads included.
+    """
+    return int(df.memory_usage(deep=True).sum())
+
+
+def _downcast_float(col):
+    down = pd.to_numeric(col, downcast='float')
+    if down.dtype == col.dtype:
+        return col
+    # float32 only keeps about 7 significant digits, keep the column when
+    # any value would change.
+    if np.array_equal(down.to_numpy(dtype='float64'), col.to_numpy(), equal_nan=True):
+        return down
+    return col
+
+
+def compact_frame(df, category_ratio=0.5, date_columns=None, date_format=None, downcast=True, log=None):
+    """
+    Returns df with compact column types. Values are unchanged, only their
+    representation is.
+    :param df: frame to compact, modified in place
+    :type df: pandas.DataFrame
+    :param category_ratio: string columns with at most this ratio of distinct
+                           values to rows are turned into categoricals
+    :type category_ratio: float
+    :param date_columns: string columns to parse with date_format, unparseable
+                         values become NaT
+    :type date_columns: list
+    :param date_format: strftime format of date_columns, e.g. '%Y%m%d'
+    :type date_format: string
+    :param downcast: also downcast numbers and convert date objects. Leave it
+                     off for frames written with to_sql.
+    :type downcast: bool
+    :param log: logger receiving the memory before and after
+    """
+    before = memory_bytes(df) if log is not None else None
+    date_columns = set(date_columns or ())
+    rows = len(df)
+    for name in df.columns:
+        col = df[name]
+        text = col.dtype == object or pd.api.types.is_string_dtype(col)
+        if name in date_columns and text:
+            # cache=True parses each distinct value once.
+            df[name] = pd.to_datetime(col, format=date_format, errors='coerce', cache=True)
+        elif pd.api.types.is_bool_dtype(col):
+            continue
+        elif not downcast and not text:
+            continue
+        elif pd.api.types.is_integer_dtype(col):
+            df[name] = pd.to_numeric(col, downcast='unsigned' if rows and col.min() >= 0 else 'integer')
+        elif pd.api.types.is_float_dtype(col):
+            df[name] = _downcast_float(col)
+        elif text and rows:
+            kind = pd.api.types.infer_dtype(col, skipna=True)
+            if kind == 'date' and downcast:
+                df[name] = pd.to_datetime(col, errors='coerce', cache=True)
+            elif kind == 'string' and col.nunique(dropna=True) <= category_ratio * rows:
+                df[name] = col.astype('category')
+    if log is not None:
+        after = memory_bytes(df)
+        log.info('Compacted frame of %s rows from %.1f MiB to %.1f MiB',
+                 rows, before / 1048576.0, after / 1048576.0)
+    return df
@@ -13,18 +13,243 @@ More details can be found here:
 https://developers.google.com/api-client-library/python/guide/aaa_client_secrets
 """
 
+import datetime
+import hashlib
+import json
+import random
+import threading
 import time
 import os
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+import httplib2
 from airflow.hooks.base_hook import BaseHook
 from airflow import configuration as conf
 from apiclient.discovery import build
+from apiclient.errors import HttpError
 from apiclient.http import MediaInMemoryUpload
+from googleapiclient.discovery_cache.base import Cache
 from oauth2client.service_account import ServiceAccountCredentials
 from oauth2client.client import AccessTokenCredentials
 from collections import namedtuple
 from airflow.plugins_manager import AirflowPlugin
 
+# Credentials and built service objects are reused by every hook of the
+# worker process. Service objects wrap an httplib2.Http, which is not thread
+# safe, so they are kept per thread.
+_credentials = {}
+_credentials_lock = threading.Lock()
+_local = threading.local()
+# Rate limiters shared by the threads of the process, per project and view.
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+# The Reporting API v4 serves at most 10 concurrent requests per view and
+# takes at most 5 reportRequests per batchGet.
+MAX_CONCURRENT_REQUESTS = 10
+MAX_BATCH_REQUESTS = 5
+# Requests of one batchGet must agree on these fields.
+BATCH_FIELDS = ('viewId', 'dateRanges', 'samplingLevel', 'segments', 'cohortGroup')
+# Default request rates, per second. Projects get 2,000 requests per 100
+# seconds, views have no rate quota of their own besides the daily one.
+PROJECT_QPS = 20.0
+VIEW_QPS = 10.0
+RETRY_STATUSES = (429, 500, 503)
+RETRY_REASONS = (b'RESOURCE_EXHAUSTED', b'rateLimitExceeded', b'userRateLimitExceeded')
+MAX_BACKOFF = 64
+# Marks the end of the pages of a batch in iter_pages.
+_END = object()
+SLICE_DAYS = {'day': 1, 'week': 7}
+DATE_DIMENSIONS = ('ga:date', 'ga:dateHour', 'ga:dateHourMinute', 'ga:week', 'ga:isoWeek', 'ga:yearWeek',
+                   'ga:isoYearIsoWeek', 'ga:month', 'ga:yearMonth', 'ga:year')
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket of rate tokens per second holding at most burst
+    tokens. A request that finds the bucket empty reserves the next token and
+    sleeps until it is due.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token and returns the seconds waited for it.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def get_bucket(key, rate, burst=None):
+    """
+    Returns the process wide bucket of key, created with rate and burst by
+    its first user.
+    """
+    with _buckets_lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(rate, burst)
+        return _buckets[key]
+
+
+def is_retryable(error):
+    if error.resp.status in RETRY_STATUSES:
+        return True
+    content = error.content or b''
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    return any(reason in content for reason in RETRY_REASONS)
+
+
+def date_slices(since, until, date_slice=None):
+    """
+    Splits the inclusive since..until range ('%Y-%m-%d') into consecutive
+    (startDate, endDate) slices of a day or a week, or returns the whole
+    range as one slice when date_slice is None.
+    """
+    if date_slice is None:
+        return [(since, until)]
+    if date_slice not in SLICE_DAYS:
+        raise ValueError('Please specify date_slice as one of {0}.'.format(sorted(SLICE_DAYS)))
+    try:
+        start = datetime.datetime.strptime(since, '%Y-%m-%d').date()
+        end = datetime.datetime.strptime(until, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('date_slice requires since and until as %Y-%m-%d dates, got {0} and {1}.'.format(
+            since, until))
+    step = datetime.timedelta(days=SLICE_DAYS[date_slice] - 1)
+    slices = []
+    while start <= end:
+        slice_end = min(start + step, end)
+        slices.append((start.isoformat(), slice_end.isoformat()))
+        start = slice_end + datetime.timedelta(days=1)
+    return slices
+
+
+def batch_key(report_request):
+    return json.dumps([report_request.get(field) for field in BATCH_FIELDS], sort_keys=True)
+
+
+def pack_batches(report_requests):
+    """
+    Groups the indexes of compatible report_requests into batches of at most
+    MAX_BATCH_REQUESTS, in the order of their first request.
+    """
+    groups = OrderedDict()
+    for index, report_request in enumerate(report_requests):
+        groups.setdefault(batch_key(report_request), []).append(index)
+    return [indexes[start:start + MAX_BATCH_REQUESTS]
+            for indexes in groups.values()
+            for start in range(0, len(indexes), MAX_BATCH_REQUESTS)]
+
+
+class PageColumns(OrderedDict):
+    """
+    Columns of a report page, with metric_types mapping the metric columns
+    to their columnHeader type (INTEGER, FLOAT, CURRENCY, ...).
+    """
+    metric_types = {}
+
+
+def page_columns(report, column_header, view_id=None):
+    """
+    Flattens the rows of a report page into a PageColumns of column name to
+    values: viewId when view_id is given, the dimensions, then the metrics
+    of the first date range.
+    """
+    rows = report.get('data', {}).get('rows', [])
+    columns = PageColumns()
+    if view_id is not None:
+        columns['viewId'] = [view_id] * len(rows)
+    for position, name in enumerate(column_header.get('dimensions', [])):
+        columns[name] = [row['dimensions'][position] for row in rows]
+    entries = column_header.get('metricHeader', {}).get('metricHeaderEntries', [])
+    for position, entry in enumerate(entries):
+        columns[entry['name']] = [row['metrics'][0]['values'][position] for row in rows]
+    columns.metric_types = dict((entry['name'], entry.get('type', 'METRIC_TYPE_UNSPECIFIED')) for entry in entries)
+    return columns
+
+
+def merge_reports(reports):
+    """
+    Merges reports of the same columns into the first one. Totals and
+    sampling figures only hold for one report, only the rows are kept.
+    """
+    merged = {}
+    rows = []
+    for report in reports:
+        if not report:
+            continue
+        if not merged:
+            merged = report
+        rows.extend(report.get('data', {}).get('rows', []))
+    if merged:
+        merged['data'] = {'rows': rows, 'rowCount': len(rows)}
+    return merged
+
+
+class DiscoveryDocumentCache(Cache):
+    """
+    Discovery document cache for apiclient build(cache=...): documents are
+    kept in memory and on local disk for max_age seconds, so a worker fetches
+    each of them at most once a day instead of on every build().
+    """
+
+    def __init__(self, directory, max_age=86400):
+        self.directory = directory
+        self.max_age = max_age
+        self.memory = {}
+        self.lock = threading.Lock()
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url):
+        with self.lock:
+            entry = self.memory.get(url)
+        if entry is not None and time.time() - entry[0] < self.max_age:
+            return entry[1]
+        path = self._path(url)
+        try:
+            modified = os.path.getmtime(path)
+            if time.time() - modified >= self.max_age:
+                return None
+            with open(path) as handle:
+                content = handle.read()
+        except (IOError, OSError):
+            return None
+        with self.lock:
+            self.memory[url] = (modified, content)
+        return content
+
+    def set(self, url, content):
+        with self.lock:
+            self.memory[url] = (time.time(), content)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = '{0}.{1}.tmp'.format(self._path(url), os.getpid())
+            with open(tmp_path, 'w') as handle:
+                handle.write(content)
+            os.replace(tmp_path, self._path(url))
+        except (IOError, OSError):
+            pass
+
+
+_discovery_cache = DiscoveryDocumentCache(os.path.join(conf.get('core', 'airflow_home'), 'cache', 'ga_discovery'))
 
 
 class GoogleAnalyticsHook(BaseHook):
@@ -40,32 +265,260 @@ class GoogleAnalyticsHook(BaseHook):
     }
     _key_folder = os.path.join(conf.get('core', 'airflow_home'), 'keys')
 
+    # Attempts of a request failing with a quota or availability error.
+    max_retries = 6
+
     def __init__(self, google_analytics_conn_id='google_analytics', key_file=None):
         self.google_analytics_conn_id = google_analytics_conn_id
         self.connection = self.get_connection(google_analytics_conn_id)
-        if 'client_secrets' in self.connection.extra_dejson:
-            self.client_secrets = self.connection.extra_dejson['client_secrets']
+        extras = self.connection.extra_dejson
+        if 'client_secrets' in extras:
+            self.client_secrets = extras['client_secrets']
         if key_file:
             self.file_location = os.path.join(GoogleAnalyticsHook._key_folder, key_file)
 
-    def get_service_object(self, name):
-        service = GoogleAnalyticsHook._services[name]
+        # Request rates can be set in the connection extras as project_qps
+        # and view_qps (and project_burst, view_burst).
+        self.project_id = (extras.get('project_id') or
+                           extras.get('client_secrets', {}).get('project_id') or
+                           google_analytics_conn_id)
+        self.project_bucket = get_bucket(('project', self.project_id),
+                                         float(extras.get('project_qps', PROJECT_QPS)), extras.get('project_burst'))
+        self.view_rate = (float(extras.get('view_qps', VIEW_QPS)), extras.get('view_burst'))
+        self.throttled = 0.0
+        self.throttled_lock = threading.Lock()
+
+    # Credentials are refreshed when their token expires within this window.
+    refresh_margin = datetime.timedelta(minutes=5)
 
+    def credentials_key(self, service):
         if self.connection.password:
-            credentials = AccessTokenCredentials(self.connection.password,
-                                                 'Airflow/1.0')
+            source = 'token:' + self.connection.password
         elif hasattr(self, 'client_secrets'):
-            credentials = ServiceAccountCredentials.from_json_keyfile_dict(self.client_secrets,
-                                                                           service.scopes)
-
+            source = 'secrets:' + json.dumps(self.client_secrets, sort_keys=True)
         elif hasattr(self, 'file_location'):
-            credentials = ServiceAccountCredentials.from_json_keyfile_name(self.file_location,
-                                                                           service.scopes)
+            source = 'file:{0}:{1}'.format(self.file_location, os.path.getmtime(self.file_location))
         else:
             raise ValueError('No valid credentials could be found')
+        return hashlib.sha256(source.encode('utf-8')).hexdigest(), tuple(service.scopes)
+
+    def load_credentials(self, service):
+        if self.connection.password:
+            return AccessTokenCredentials(self.connection.password,
+                                          'Airflow/1.0')
+        elif hasattr(self, 'client_secrets'):
+            return ServiceAccountCredentials.from_json_keyfile_dict(self.client_secrets,
+                                                                    service.scopes)
+        elif hasattr(self, 'file_location'):
+            return ServiceAccountCredentials.from_json_keyfile_name(self.file_location,
+                                                                    service.scopes)
+        raise ValueError('No valid credentials could be found')
+
+    def get_credentials(self, service):
+        """
+        Returns the credentials of this connection for service, shared by the
+        worker process. Their token is refreshed only when it is about to
+        expire; a fresh credentials object fetches one on its first request.
+        """
+        key = self.credentials_key(service)
+        with _credentials_lock:
+            credentials = _credentials.get(key)
+            if credentials is None:
+                credentials = _credentials[key] = self.load_credentials(service)
+            expiry = getattr(credentials, 'token_expiry', None)
+            if (expiry is not None and not isinstance(credentials, AccessTokenCredentials) and
+                    expiry - datetime.datetime.utcnow() < self.refresh_margin):
+                credentials.refresh(httplib2.Http())
+        return key, credentials
+
+    def get_service_object(self, name):
+        service = GoogleAnalyticsHook._services[name]
+        key, credentials = self.get_credentials(service)
+
+        services = getattr(_local, 'services', None)
+        if services is None:
+            services = _local.services = {}
+        if (key, name) not in services:
+            services[(key, name)] = build(service.name, service.version, credentials=credentials,
+                                          cache=_discovery_cache)
+        return services[(key, name)]
+
+
+    def add_throttled(self, seconds):
+        with self.throttled_lock:
+            self.throttled += seconds
+
+    def execute_request(self, request, view_id):
+        """
+        Executes an API request once the project and view buckets allow it.
+        Quota and availability errors (429, 500, 503, RESOURCE_EXHAUSTED) are
+        retried up to max_retries times after an exponential backoff with
+        jitter. Time spent waiting is added to throttled.
+        """
+        view_bucket = get_bucket(('view', view_id), *self.view_rate)
+        attempt = 0
+        while True:
+            self.add_throttled(self.project_bucket.acquire() + view_bucket.acquire())
+            try:
+                return request.execute()
+            except HttpError as error:
+                if attempt >= self.max_retries or not is_retryable(error):
+                    raise
+                delay = min(MAX_BACKOFF, 2 ** attempt) + random.random()
+                attempt += 1
+                self.log.warning('GA request for view %s failed with status %s, retry %s of %s in %.1fs',
+                                 view_id, error.resp.status, attempt, self.max_retries, delay)
+                time.sleep(delay)
+                self.add_throttled(delay)
 
-        return build(service.name, service.version, credentials=credentials)
+    def iter_batch_pages(self, report_requests):
+        """
+        Yields (index, page) for every page of up to 5 compatible
+        reportRequests, sent together as one batchGet, as the pages arrive.
+        Every report is paginated independently, a page request only carries
+        the reports with a next page.
+        """
+        analytics = self.get_service_object(name='reporting')
+        requests = [dict(report_request) for report_request in report_requests]
+        pending = list(range(len(requests)))
+
+        while pending:
+            body = {'reportRequests': [requests[index] for index in pending]}
+            response = self.execute_request(analytics.reports().batchGet(body=body), requests[0]['viewId'])
+            next_pending = []
+            for index, report in zip(pending, response.get('reports', [])):
+                if report.get('nextPageToken'):
+                    requests[index]['pageToken'] = report['nextPageToken']
+                    next_pending.append(index)
+                yield index, report
+            pending = next_pending
+
+    def fetch_reports(self, report_requests):
+        """
+        Returns the reports of up to 5 compatible reportRequests with the rows
+        of all their pages. Reports missing from the response are {}.
+        """
+        reports = [{} for _ in report_requests]
+        rows = [[] for _ in report_requests]
+        for index, report in self.iter_batch_pages(report_requests):
+            reports[index] = report
+            rows[index].extend(report.get('data', {}).get('rows', []))
+
+        for report, report_rows in zip(reports, rows):
+            if report.get('data'):
+                report['data']['rows'] = report_rows
+        return reports
+
+    def iter_pages(self, report_requests, max_workers=1):
+        """
+        Yields (index, page) for the pages of report_requests, packed in
+        batches as by get_analytics_reports. Batches are yielded in order,
+        their pages as they arrive. With max_workers > 1, up to max_workers
+        batches are fetched ahead, each holding at most one page until it
+        is consumed.
+        """
+        batches = pack_batches(report_requests)
+        workers = max(1, min(max_workers or 1, MAX_CONCURRENT_REQUESTS, len(batches)))
+        self.log.info('Streaming %s reports in %s batches with %s workers', len(report_requests), len(batches),
+                      workers)
+        if workers == 1:
+            for batch in batches:
+                for index, page in self.iter_batch_pages([report_requests[index] for index in batch]):
+                    yield batch[index], page
+            return
+
+        stopped = threading.Event()
+
+        def put(pages, item):
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce(batch, pages):
+            if stopped.is_set():
+                return
+            try:
+                for index, page in self.iter_batch_pages([report_requests[index] for index in batch]):
+                    if not put(pages, (batch[index], page)):
+                        return
+            except Exception as error:
+                put(pages, error)
+            finally:
+                put(pages, _END)
 
+        queues = [queue.Queue(maxsize=1) for _ in batches]
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for batch, pages in zip(batches, queues):
+                executor.submit(produce, batch, pages)
+            for pages in queues:
+                while True:
+                    item = pages.get()
+                    if item is _END:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+        finally:
+            stopped.set()
+            executor.shutdown(wait=True)
+
+    def get_analytics_reports(self, report_requests, max_workers=1):
+        """
+        Returns the reports of report_requests in their order, each tagged
+        with its viewId. Compatible requests (same view, date ranges,
+        sampling level, segments and cohorts) are packed by 5 per batchGet,
+        batches are sent by up to max_workers threads.
+        """
+        batches = pack_batches(report_requests)
+        workers = max(1, min(max_workers or 1, MAX_CONCURRENT_REQUESTS, len(batches)))
+        self.log.info('Fetching %s reports in %s batches with %s workers', len(report_requests), len(batches), workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda batch: self.fetch_reports([report_requests[index] for index in batch]),
+                                   batches)
+            reports = [{} for _ in report_requests]
+            for batch, batch_reports in zip(batches, results):
+                for index, report in zip(batch, batch_reports):
+                    if report:
+                        report['viewId'] = report_requests[index]['viewId']
+                    reports[index] = report
+        if self.throttled:
+            self.log.info('Throttled by GA quotas for %.1fs', self.throttled)
+        return reports
+
+    def report_requests(self, views, since, until, sampling_level, dimensions, metrics, page_size,
+                        include_empty_rows, dimension_filter_clauses, date_slice=None):
+        """
+        Returns the reportRequests of every view and date slice of since..until,
+        by view then date.
+        """
+        slices = date_slices(since, until, date_slice)
+        if len(slices) > 1 and not any(dimension.get('name') in DATE_DIMENSIONS for dimension in dimensions):
+            self.log.warning('Report sliced by %s without a date dimension, its rows repeat for every slice',
+                             date_slice)
+
+        requests = []
+        for view in views:
+            for start, end in slices:
+                requests.append({
+                    'viewId': view,
+                    'dateRanges': [{'startDate': start, 'endDate': end}],
+                    'samplingLevel': sampling_level or 'LARGE',
+                    'dimensions': dimensions,
+                    'metrics': metrics,
+                    'pageSize': page_size or 1000,
+                    'includeEmptyRows': include_empty_rows or False,
+                    'dimensionFilterClauses' : dimension_filter_clauses or None
+                })
+        return requests
+
+    def log_sampled(self, request):
+        self.log.warning('Report of view %s from %s to %s is sampled', request['viewId'],
+                         request['dateRanges'][0]['startDate'], request['dateRanges'][0]['endDate'])
 
     def get_analytics_report(self,
                              view_id,
@@ -76,46 +529,63 @@ class GoogleAnalyticsHook(BaseHook):
                              metrics,
                              page_size,
                              include_empty_rows,
-                             dimension_filter_clauses):
+                             dimension_filter_clauses,
+                             date_slice=None,
+                             max_workers=1):
+        """
+        Returns the report of view_id over since..until. With date_slice
+        ('day' or 'week') the range is requested slice by slice, by up to
+        max_workers threads, and the slice rows are merged in date order.
+        Slices are reported separately, so the report should have a date
+        dimension. Smaller slices are also less likely to be sampled.
+        view_id may be a list of views, their rows are then merged in that
+        order with a leading viewId dimension.
+        """
+        views = [str(view) for view in view_id] if isinstance(view_id, (list, tuple)) else [str(view_id)]
+        requests = self.report_requests(views, since, until, sampling_level, dimensions, metrics, page_size,
+                                        include_empty_rows, dimension_filter_clauses, date_slice)
+        reports = self.get_analytics_reports(requests, max_workers=max_workers)
 
-        analytics = self.get_service_object(name='reporting')
-
-        reportRequest = {
-            'viewId': view_id,
-            'dateRanges': [{'startDate': since, 'endDate': until}],
-            'samplingLevel': sampling_level or 'LARGE',
-            'dimensions': dimensions,
-            'metrics': metrics,
-            'pageSize': page_size or 1000,
-            'includeEmptyRows': include_empty_rows or False,
-            'dimensionFilterClauses' : dimension_filter_clauses or None
-        }
-
-        response = (analytics
-                    .reports()
-                    .batchGet(body={'reportRequests': [reportRequest]})
-                    .execute())
-
-        if response.get('reports'):
-            report = response['reports'][0]
-            rows = report.get('data', {}).get('rows', [])
-
-            while report.get('nextPageToken'):
-                time.sleep(1)
-                reportRequest.update({'pageToken': report['nextPageToken']})
-                response = (analytics
-                    .reports()
-                    .batchGet(body={'reportRequests': [reportRequest]})
-                    .execute())
-                report = response['reports'][0]
-                rows.extend(report.get('data', {}).get('rows', []))
-
-            if report['data']:
-                report['data']['rows'] = rows
-
-            return report
-        else:
-            return {}
+        for request, report in zip(requests, reports):
+            if report.get('data', {}).get('samplesReadCounts'):
+                self.log_sampled(request)
+            if len(views) > 1 and report:
+                report['columnHeader']['dimensions'] = ['viewId'] + report['columnHeader'].get('dimensions', [])
+                for row in report.get('data', {}).get('rows', []):
+                    row['dimensions'] = [request['viewId']] + row['dimensions']
 
-        
+        if len(reports) == 1:
+            return reports[0]
+        return merge_reports(reports)
 
+    def iter_report_pages(self,
+                          view_id,
+                          since,
+                          until,
+                          sampling_level,
+                          dimensions,
+                          metrics,
+                          page_size,
+                          include_empty_rows,
+                          dimension_filter_clauses,
+                          date_slice=None,
+                          max_workers=1):
+        """
+        Streaming get_analytics_report: yields every report page as it
+        arrives, flattened by page_columns into a PageColumns of column name
+        (as in the columnHeader, with a leading viewId when view_id is a list)
+        to values. Only the pages in flight are held in memory.
+        """
+        views = [str(view) for view in view_id] if isinstance(view_id, (list, tuple)) else [str(view_id)]
+        requests = self.report_requests(views, since, until, sampling_level, dimensions, metrics, page_size,
+                                        include_empty_rows, dimension_filter_clauses, date_slice)
+        headers = {}
+        for index, page in self.iter_pages(requests, max_workers=max_workers):
+            request = requests[index]
+            if index not in headers:
+                if page.get('data', {}).get('samplesReadCounts'):
+                    self.log_sampled(request)
+            headers[index] = page.get('columnHeader') or headers.get(index, {})
+            yield page_columns(page, headers[index], request['viewId'] if len(views) > 1 else None)
+        if self.throttled:
+            self.log.info('Throttled by GA quotas for %.1fs', self.throttled)
@@ -5,10 +5,25 @@
 import pandas as pd
 from airflow.models import BaseOperator
 import warnings
+import itertools
 from datetime import datetime
+from sqlalchemy.types import BigInteger, DateTime, Float, Text
 from airflow.plugins_manager import AirflowPlugin
 from google_analytics_plugin.hooks.psql_hook import PSqlHook
 from google_analytics_plugin.hooks.google_analytics_hook import GoogleAnalyticsHook
+from google_analytics_plugin.hooks.frame_compaction import compact_frame
+from google_analytics_plugin.operators.profiling import profiled
+from google_analytics_plugin.operators.task_metrics import TaskMetrics, chunk_size
+
+
+def integers(values):
+    """
+    Coerces values to nullable Int64, or to floats when some are not integral.
+    """
+    numbers = pd.to_numeric(values, errors='coerce')
+    if (numbers.dropna() % 1 == 0).all():
+        return numbers.astype('Int64')
+    return numbers
 
 
 class GoogleAnalyticsReportingToPSqlOperator(BaseOperator):
@@ -16,7 +31,8 @@ class GoogleAnalyticsReportingToPSqlOperator(BaseOperator):
         Google Analytics Reporting To PSql Operator
         :param google_analytics_conn_id:        The Google Analytics connection id.
         :type google_analytics_conn_id:         string
-        :param view_id:                                         The view id for associated report.
+        :param view_id:                                         The view id for associated report. A list of views
+                                                                loads their rows together with a viewId column.
         :type view_id:                                          string/array
         :param since:                                           The date up from which to pull GA data.
                                                                 This can either be a string in the format
@@ -42,6 +58,26 @@ class GoogleAnalyticsReportingToPSqlOperator(BaseOperator):
         :type database:                                         string
         :param table:                                           To pxsql table.
         :type table:                                            string
+        :param load_method:                                     'insert' for pandas to_sql, 'batched' for
+                                                                size-bounded multi-row INSERTs or 'copy' to
+                                                                stream the rows with COPY FROM STDIN.
+        :type load_method:                                      string
+        :param if_exists:                                       pandas if_exists ('fail', 'replace', 'append')
+                                                                or 'merge' to upsert the rows on merge_keys
+                                                                through a temporary staging table.
+        :type if_exists:                                        string
+        :param merge_keys:                                      Key columns of the table for if_exists 'merge'.
+        :type merge_keys:                                       list
+        :param compact:                                         Store repetitive dimensions as categoricals before
+                                                                loading, logging the memory saved. Column types
+                                                                are fixed by the report's metric types and dtype_map.
+        :type compact:                                          bool
+        :param date_slice:                                      'day' or 'week' to request the date range slice by
+                                                                slice, the report should then have a date dimension.
+                                                                Smaller slices are less likely to be sampled.
+        :type date_slice:                                       string
+        :param max_workers:                                     Slices fetched concurrently, at most 10.
+        :type max_workers:                                      int
         """
 
     def __init__(self,
@@ -64,6 +100,11 @@ class GoogleAnalyticsReportingToPSqlOperator(BaseOperator):
                  column_map=None,
                  dtype_map=None,
                  dimension_filter_clauses=None,
+                 load_method='insert',
+                 merge_keys=None,
+                 compact=False,
+                 date_slice=None,
+                 max_workers=1,
                  *args,
                  **kwargs):
         super().__init__(*args, **kwargs)
@@ -88,14 +129,25 @@ class GoogleAnalyticsReportingToPSqlOperator(BaseOperator):
         self.dtype_map = dtype_map
         self.dimension_filter_clauses = dimension_filter_clauses
         self.input_task_id = input_task_id
+        self.load_method = load_method
+        self.merge_keys = merge_keys
+        self.compact = compact
+        self.date_slice = date_slice
+        self.max_workers = max_workers
 
+        # SQL types of the GA metric types and of the dtype_map values. GA TIME metrics are seconds.
         self.metric_map = {
-            'METRIC_TYPE_UNSPECIFIED': 'varchar(255)',
-            'CURRENCY': 'decimal(20,5)',
-            'INTEGER': 'int(11)',
-            'FLOAT': 'decimal(20,5)',
-            'PERCENT': 'decimal(20,5)',
-            'TIME': 'time'
+            'METRIC_TYPE_UNSPECIFIED': Text(),
+            'CURRENCY': Float(precision=53),
+            'INTEGER': BigInteger(),
+            'FLOAT': Float(precision=53),
+            'PERCENT': Float(precision=53),
+            'TIME': Float(precision=53)
+        }
+        self.dtype_sql_map = {
+            'date': DateTime(),
+            'int': BigInteger(),
+            'float': Float(precision=53)
         }
 
         if self.page_size > 10000:
@@ -104,7 +156,66 @@ class GoogleAnalyticsReportingToPSqlOperator(BaseOperator):
         if not isinstance(self.include_empty_rows, bool):
             raise Exception('Please specificy "include_empty_rows" as a boolean.')
 
+    def column_types(self, columns):
+        """
+        SQL types of the table columns, fixed from the first report page so that the values of a page
+        cannot size them: the metric types of the column header, overridden by dtype_map, and text
+        for the dimensions. Keys are renamed with column_map.
+        """
+        types = dict((name.replace('ga:', ''), self.metric_map.get(columns.metric_types.get(name), Text()))
+                     for name in columns)
+        for key, value in (self.dtype_map or {}).items():
+            if key in types and value in self.dtype_sql_map:
+                types[key] = self.dtype_sql_map[value]
+        if self.column_map:
+            types = dict((self.column_map.get(key, key), sql_type) for key, sql_type in types.items())
+        return types
+
+    def frame_from_page(self, columns):
+        """
+        Builds a DataFrame from a report page flattened by the hook, typed with the metric types and
+        dtype_map and renamed with column_map. Integer columns are nullable Int64, a value coerced to
+        NaN does not turn them into floats.
+        """
+        df_ = pd.DataFrame(dict((name.replace('ga:', ''), values) for name, values in columns.items()))
+
+        for name, metric_type in columns.metric_types.items():
+            key = name.replace('ga:', '')
+            if metric_type == 'INTEGER':
+                df_[key] = integers(df_[key])
+            elif metric_type != 'METRIC_TYPE_UNSPECIFIED':
+                df_[key] = pd.to_numeric(df_[key], errors='coerce')
+
+        if self.dtype_map:
+            for key, value in self.dtype_map.items():
+                if key in df_.columns and value == 'date':
+                    df_[key] = pd.to_datetime(df_[key], format='%Y%m%d', errors='coerce')
+                if key in df_.columns and value == 'int':
+                    df_[key] = integers(df_[key])
+                if key in df_.columns and value == 'float':
+                    df_[key] = pd.to_numeric(df_[key], errors='coerce')
+
+        if self.column_map:
+            df_ = df_.rename(self.column_map, axis=1)
+
+        if self.compact:
+            df_ = compact_frame(df_, downcast=False, log=self.log)
+
+        return df_
+
+    def frames(self, pages, task_metrics):
+        """
+        Yields a DataFrame per report page, so that loading starts with the first page.
+        """
+        for columns in pages:
+            with task_metrics.phase('transform'):
+                df_ = self.frame_from_page(columns)
+            task_metrics.add(bytes=chunk_size(df_)[1])
+            yield df_
+
+    @profiled
     def execute(self, context):
+        task_metrics = TaskMetrics(self)
         try:
             since_formatted = datetime.strptime(self.since, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d')
         except:
@@ -119,40 +230,31 @@ class GoogleAnalyticsReportingToPSqlOperator(BaseOperator):
         except:
             until_formatted = str(self.until)
 
-        ga_conn = GoogleAnalyticsHook(self.google_analytics_conn_id, key_file=self.key_file)
-
-        report = ga_conn.get_analytics_report(self.view_id,
-                                              since_formatted,
-                                              until_formatted,
-                                              self.sampling_level,
-                                              self.dimensions,
-                                              self.metrics,
-                                              self.page_size,
-                                              self.include_empty_rows,
-                                              self.dimension_filter_clauses)
-
-        dimensionheaders = [header.replace('ga:', '') for header in report['columnHeader'].get('dimensions', [])]
-        metricheaders = [entry.get('name').replace('ga:', '') for entry in
-                         report['columnHeader'].get('metricHeader', {}).get('metricHeaderEntries', [])]
-
-        dl = [row['dimensions'] + row['metrics'][0]['values'] for row in report.get('data', {}).get('rows', [])]
-        df_ = pd.DataFrame(dl, columns=dimensionheaders + metricheaders)
-
-        if self.dtype_map:
-            for key, value in self.dtype_map.items():
-                if key in df_.columns and value == 'date':
-                    df_[key] = pd.to_datetime(df_[key], format='%Y%m%d', errors='coerce')
-                if key in df_.columns and value == 'int':
-                    df_[key] = pd.to_numeric(df_[key], errors='coerce')
-                if key in df_.columns and value == 'float':
-                    df_[key] = pd.to_numeric(df_[key], errors='coerce')
-
-        if self.column_map:
-            df_ = df_.rename(self.column_map, axis=1)
+        with task_metrics.phase('connect'):
+            ga_conn = GoogleAnalyticsHook(self.google_analytics_conn_id, key_file=self.key_file)
 
-        self.log.info('Executing: %s', )
         psql_hook = PSqlHook(psql_conn_id=self.psql_conn_id, schema=self.database)
-        conn = psql_hook.get_conn()
-        if self.schema:
-            conn.execute("set search_path to " + self.schema)
-        df_.to_sql(self.table, conn, if_exists=self.if_exists, index=False)
+        task_metrics.connect(psql_hook)
+
+        pages = task_metrics.track(ga_conn.iter_report_pages(self.view_id,
+                                                             since_formatted,
+                                                             until_formatted,
+                                                             self.sampling_level,
+                                                             self.dimensions,
+                                                             self.metrics,
+                                                             self.page_size,
+                                                             self.include_empty_rows,
+                                                             self.dimension_filter_clauses,
+                                                             date_slice=self.date_slice,
+                                                             max_workers=self.max_workers))
+        # The first page fixes the column types of a created table.
+        first = next(pages, None)
+        dtype = self.column_types(first) if first is not None else None
+        pages = itertools.chain([first], pages) if first is not None else pages
+        with task_metrics.consuming(self.frames(pages, task_metrics)) as frames:
+            psql_hook.load_frames(frames, self.table, if_exists=self.if_exists,
+                                  load_method=self.load_method, schema=self.schema or None,
+                                  merge_keys=self.merge_keys, dtype=dtype)
+        task_metrics.add_time('throttled', ga_conn.throttled)
+        self.log.info('Loaded %s rows into %s', task_metrics.rows, self.table)
+        task_metrics.report(context)
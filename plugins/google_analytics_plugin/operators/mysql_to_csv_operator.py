@@ -1,19 +1,55 @@
 #Outputs sql-query results to a csv flatfile.
+#Streams the result chunk by chunk from a server-side cursor, optionally
+#gzip/zstd compressed and rolled over into numbered part files.
 
 from airflow.models import BaseOperator
+import gzip
+import io
+import os
 import pandas as pd
 from datetime import datetime
 from airflow.plugins_manager import AirflowPlugin
 from google_analytics_plugin.hooks.mysql_hook import MySqlHook
+from google_analytics_plugin.operators.profiling import profiled
+from google_analytics_plugin.operators.task_metrics import TaskMetrics
 
 
 class MySqlToCsvOperator(BaseOperator):
+    """
+        MySql To Csv Operator
+        :param mysql_conn_id:           Source mysql connection id.
+        :type mysql_conn_id:            string
+        :param database:                Source mysql database.
+        :type database:                 string
+        :param query:                   Query whose result is exported.
+        :type query:                    string
+        :param filename:                Output file. With max_file_bytes the parts are named
+                                        <root>.00001<ext>, <root>.00002<ext>...
+        :type filename:                 string
+        :param chunk_rows:              Rows fetched and written per chunk.
+        :type chunk_rows:               int
+        :param compression:             None, 'gzip' or 'zstd' (needs the zstandard package).
+                                        The matching extension is appended to filename.
+        :type compression:              string
+        :param max_file_bytes:          Start a new part file, with its own header, once the
+                                        current one reaches this size on disk.
+        :type max_file_bytes:           int
+        :param encoding:                Text encoding of the files.
+        :type encoding:                 string
+        :return:                        The list of files written.
+        """
+
+    extensions = {'gzip': '.gz', 'zstd': '.zst'}
 
     def __init__(self,
                  mysql_conn_id,
                  database,
                  query,
                  filename,
+                 chunk_rows=10000,
+                 compression=None,
+                 max_file_bytes=None,
+                 encoding='utf-8',
                  *args,
                  **kwargs):
                 super().__init__(*args, **kwargs)
@@ -22,16 +58,67 @@ class MySqlToCsvOperator(BaseOperator):
                 self.database = database
                 self.query = query
                 self.filename = filename
+                self.chunk_rows = chunk_rows
+                self.compression = compression
+                self.max_file_bytes = max_file_bytes
+                self.encoding = encoding
+
+                if compression is not None and compression not in self.extensions:
+                    raise Exception('Please specify compression as one of {0}.'.format(list(self.extensions)))
+
+    def part_path(self, part):
+        extension = self.extensions.get(self.compression, '')
+        filename = self.filename
+        if extension and filename.endswith(extension):
+            filename = filename[:-len(extension)]
+        if self.max_file_bytes:
+            root, ext = os.path.splitext(filename)
+            filename = '{0}.{1:05d}{2}'.format(root, part, ext)
+        return filename + extension
 
+    def open_part(self, path):
+        raw = open(path, 'wb')
+        if self.compression == 'gzip':
+            stream = gzip.GzipFile(fileobj=raw, mode='wb')
+        elif self.compression == 'zstd':
+            import zstandard
+            stream = zstandard.ZstdCompressor().stream_writer(raw)
+        else:
+            stream = raw
+        return raw, io.TextIOWrapper(stream, encoding=self.encoding, newline='')
+
+    @profiled
     def execute(self, context):
 
+        metrics = TaskMetrics(self)
         mysql_hook = MySqlHook(mysql_conn_id=self.mysql_conn_id, schema=self.database)
-        conn = mysql_hook.get_conn()
+        metrics.connect(mysql_hook)
+        paths = []
+        raw = out = None
         try:
-            df_ = pd.read_sql(self.query, conn)
-            df_.to_csv(self.filename)
-        except Exception as e:
-            print("Error {0}".format(str(e)))
-        
-
+            # Keep a running index so the output matches a single to_csv call.
+            offset = 0
+            for df_ in metrics.track(mysql_hook.iter_chunks(self.query, self.chunk_rows, as_frame=True)):
+                with metrics.phase('load'):
+                    if out is None:
+                        paths.append(self.part_path(len(paths) + 1))
+                        raw, out = self.open_part(paths[-1])
+                        header = True
+                    df_.index = pd.RangeIndex(offset, offset + len(df_))
+                    df_.to_csv(out, header=header)
+                    header = False
+                    offset += len(df_)
+                    if self.max_file_bytes:
+                        out.flush()
+                        if raw.tell() >= self.max_file_bytes:
+                            out.close()
+                            raw.close()
+                            raw = out = None
+        finally:
+            if out is not None:
+                out.close()
+                raw.close()
 
+        self.log.info('Exported %s rows to %s', offset, paths)
+        metrics.report(context)
+        return paths
@@ -1,31 +1,13 @@
 #ETL between Mysql to PostgreSQL databases
 
-####################################################
-import pandas as pd
-from pandas.io.sql import SQLTable
-
-''' This function modifies pandas builtin to_sql.__execute_insert\
- method for one insert statement for whole dataset instead of one\
- for each row. Change this for big datasets for exponential time \
- decrease in most cases.
-'''
-def _execute_insert(self, conn, keys, data_iter):
-    print("Using monkey-patched _execute_insert")
-    data = [dict((k, v) for k, v in zip(keys, row)) for row in data_iter]
-    conn.execute(self.insert_statement().values(data))
-
-SQLTable._execute_insert = _execute_insert
-
-
-####################################################
-
-
-
 from airflow.models import BaseOperator
 from datetime import datetime
 from airflow.plugins_manager import AirflowPlugin
 from google_analytics_plugin.hooks.mysql_hook import MySqlHook
 from google_analytics_plugin.hooks.psql_hook import PSqlHook
+from google_analytics_plugin.operators.table_transfer import TableTransfer
+from google_analytics_plugin.operators.profiling import profiled
+from google_analytics_plugin.operators.task_metrics import TaskMetrics
 
 
 class MySqlToPSqlOperator(BaseOperator):
@@ -38,6 +20,16 @@ class MySqlToPSqlOperator(BaseOperator):
 				 database_to,
 				 table_to,
 				 if_exists_prd,			
+                 chunk_rows=10000,
+                 load_method='batched',
+                 parallelism=1,
+                 split_column=None,
+                 incremental_column=None,
+                 watermark_key=None,
+                 merge_keys=None,
+                 queue_depth=4,
+                 load_workers=None,
+                 checksum_chunks=None,
                  *args,
                  **kwargs):
                 super().__init__(*args, **kwargs)
@@ -49,18 +41,40 @@ class MySqlToPSqlOperator(BaseOperator):
                 self.database_to = database_to
                 self.table_to = table_to
                 self.if_exists_prd = if_exists_prd	
-
+                self.chunk_rows = chunk_rows
+                self.load_method = load_method
+                self.parallelism = parallelism
+                self.split_column = split_column
+                self.incremental_column = incremental_column
+                self.watermark_key = watermark_key
+                self.merge_keys = merge_keys
+                self.queue_depth = queue_depth
+                self.load_workers = load_workers
+                self.checksum_chunks = checksum_chunks
+
+    @profiled
     def execute(self, context):
 
+        metrics = TaskMetrics(self)
         mysql_hook_from = MySqlHook(mysql_conn_id=self.mysql_conn_id_from, schema=self.database_from)
-        conn_from = mysql_hook_from.get_conn()
-        query = 'select * from ' + self.table_from
-        df_ = pd.read_sql(query, conn_from)
-
         psql_hook_to = PSqlHook(psql_conn_id=self.psql_conn_id_to, schema=self.database_to, )
-        conn_to = psql_hook_to.get_conn()
-
-        df_.to_sql(self.table_to, con=conn_to, if_exists=self.if_exists_prd, index=False)
+        metrics.connect(mysql_hook_from, psql_hook_to)
+        # Stream the source in chunks, split into key ranges when parallelism > 1
+        # and limited to rows past the watermark when incremental_column is set.
+        # Chunks are loaded by load_workers threads while the next ones are read.
+        # With checksum_chunks only the key ranges that differ are copied again.
+        transfer = TableTransfer(mysql_hook_from, psql_hook_to, self.table_from, self.table_to,
+                                 if_exists=self.if_exists_prd, chunk_rows=self.chunk_rows,
+                                 load_method=self.load_method, parallelism=self.parallelism,
+                                 split_column=self.split_column,
+                                 incremental_column=self.incremental_column,
+                                 watermark_key=self.watermark_key or
+                                 '{0}.{1}.watermark'.format(self.dag_id, self.task_id),
+                                 merge_keys=self.merge_keys, queue_depth=self.queue_depth,
+                                 load_workers=self.load_workers, checksum_chunks=self.checksum_chunks,
+                                 metrics=metrics)
+        transfer.run()
+        metrics.report(context)
 
 
 
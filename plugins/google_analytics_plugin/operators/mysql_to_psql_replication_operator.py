@@ -0,0 +1,135 @@
+#Replicates many tables of a Mysql database into PostgreSQL in a single task.
+#Tables run concurrently on a shared worker pool, largest first, through the
+#process-wide engine pools of the hooks.
+
+import fnmatch
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from airflow.exceptions import AirflowException
+from airflow.models import BaseOperator
+from airflow.plugins_manager import AirflowPlugin
+from google_analytics_plugin.hooks.mysql_hook import MySqlHook
+from google_analytics_plugin.hooks.psql_hook import PSqlHook
+from google_analytics_plugin.operators.table_transfer import TableTransfer
+from google_analytics_plugin.operators.profiling import profiled
+from google_analytics_plugin.operators.task_metrics import TaskMetrics
+
+
+class MySqlToPSqlReplicationOperator(BaseOperator):
+    """
+        MySql To PSql Replication Operator
+        :param mysql_conn_id_from:      Source mysql connection id.
+        :type mysql_conn_id_from:       string
+        :param database_from:           Source mysql database.
+        :type database_from:            string
+        :param psql_conn_id_to:         Target postgres connection id.
+        :type psql_conn_id_to:          string
+        :param database_to:             Target postgres database.
+        :type database_to:              string
+        :param tables:                  Tables to replicate. Defaults to every base table of
+                                        database_from.
+        :type tables:                   list
+        :param include:                 fnmatch patterns, only matching tables are replicated.
+        :type include:                  list
+        :param exclude:                 fnmatch patterns of tables to skip.
+        :type exclude:                  list
+        :param if_exists_prd:           pandas if_exists applied to every target table.
+        :type if_exists_prd:            string
+        :param max_workers:             Tables replicated concurrently. Keep it within the
+                                        pool_size + max_overflow of both connections.
+        :type max_workers:              int
+        :param chunk_rows:              Rows per extracted chunk.
+        :type chunk_rows:               int
+        :param load_method:             PSqlHook load method.
+        :type load_method:              string
+        :param target_prefix:           Prefix added to the target table names.
+        :type target_prefix:            string
+        :return:                        Per table summary: rows loaded, source bytes (data +
+                                        index estimate) and duration.
+        """
+
+    def __init__(self,
+                 mysql_conn_id_from,
+                 database_from,
+                 psql_conn_id_to,
+                 database_to,
+                 tables=None,
+                 include=None,
+                 exclude=None,
+                 if_exists_prd='replace',
+                 max_workers=4,
+                 chunk_rows=10000,
+                 load_method='batched',
+                 target_prefix='',
+                 *args,
+                 **kwargs):
+                super().__init__(*args, **kwargs)
+
+                self.mysql_conn_id_from = mysql_conn_id_from
+                self.database_from = database_from
+                self.psql_conn_id_to = psql_conn_id_to
+                self.database_to = database_to
+                self.tables = tables
+                self.include = include
+                self.exclude = exclude
+                self.if_exists_prd = if_exists_prd
+                self.max_workers = max_workers
+                self.chunk_rows = chunk_rows
+                self.load_method = load_method
+                self.target_prefix = target_prefix
+
+    def select_tables(self, mysql_hook):
+        """
+        Returns the (table, rows, bytes) to replicate, largest first so that
+        the long transfers do not start last and stretch the task.
+        """
+        sizes = mysql_hook.get_table_sizes()
+        if self.tables is not None:
+            known = dict((name, (rows, size)) for name, rows, size in sizes)
+            sizes = [(name, ) + known.get(name, (0, 0)) for name in self.tables]
+        if self.include:
+            sizes = [entry for entry in sizes
+                     if any(fnmatch.fnmatchcase(entry[0], pattern) for pattern in self.include)]
+        if self.exclude:
+            sizes = [entry for entry in sizes
+                     if not any(fnmatch.fnmatchcase(entry[0], pattern) for pattern in self.exclude)]
+        return sorted(sizes, key=lambda entry: entry[2], reverse=True)
+
+    def replicate(self, mysql_hook, psql_hook, table, size, metrics):
+        start = time.time()
+        transfer = TableTransfer(mysql_hook, psql_hook, table, self.target_prefix + table,
+                                 if_exists=self.if_exists_prd, chunk_rows=self.chunk_rows,
+                                 load_method=self.load_method, load_workers=1, metrics=metrics)
+        rows = transfer.run()
+        return {'table': table, 'rows': rows, 'bytes': size, 'seconds': round(time.time() - start, 3)}
+
+    @profiled
+    def execute(self, context):
+
+        mysql_hook = MySqlHook(mysql_conn_id=self.mysql_conn_id_from, schema=self.database_from)
+        psql_hook = PSqlHook(psql_conn_id=self.psql_conn_id_to, schema=self.database_to)
+        metrics = TaskMetrics(self)
+        metrics.connect(mysql_hook, psql_hook)
+        tables = self.select_tables(mysql_hook)
+        self.log.info('Replicating %s tables with %s workers', len(tables), self.max_workers)
+
+        summary = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [(table, pool.submit(self.replicate, mysql_hook, psql_hook, table, size, metrics))
+                       for table, rows, size in tables]
+            for table, future in futures:
+                try:
+                    summary.append(future.result())
+                except Exception:
+                    self.log.exception('Replication of %s failed', table)
+                    failed.append(table)
+
+        for entry in summary:
+            self.log.info('%-40s %12s rows %14s bytes %10.1fs',
+                          entry['table'], entry['rows'], entry['bytes'], entry['seconds'])
+        metrics.report(context)
+        if failed:
+            raise AirflowException('Replication failed for tables: {0}'.format(', '.join(failed)))
+        return summary
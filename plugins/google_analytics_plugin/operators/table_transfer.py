@@ -0,0 +1,424 @@
+# Moves the rows of a MySQL table into a MySQL or PostgreSQL table.
+# Shared by MySqlToMySqlOperator and MySqlToPSqlOperator.
+# With parallelism > 1 the source is split into key ranges that are extracted
+# and loaded concurrently on a thread pool.
+# With an incremental_column only rows past the last high-water mark, kept in
+# an Airflow Variable, are transferred.
+# With checksum_chunks the key space is split into chunks whose row count and
+# checksum are compared on both sides, and only differing chunks are copied.
+# Extraction and loading overlap: reader threads push chunks into a bounded
+# queue that writer threads drain into the target, so a slow side throttles
+# the other and at most queue_depth chunks wait in memory.
+
+import itertools
+import numbers
+import queue
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from airflow.exceptions import AirflowException
+from airflow.models import Variable
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+
+_END = object()
+
+
+def _quote_ident(name):
+    return '`' + name.replace('`', '``') + '`'
+
+
+def get_watermark(key, column):
+    """
+    Returns the high-water mark stored under the Variable key for column,
+    None when there is none yet or it was recorded for another column.
+    """
+    stored = Variable.get(key, default_var=None, deserialize_json=True)
+    if not stored or stored.get('column') != column:
+        return None
+    return stored.get('value')
+
+
+def set_watermark(key, column, value):
+    """
+    Stores the high-water mark of column under the Variable key.
+    Values that are not plain numbers are stored in their string form,
+    which MySQL compares correctly against date and datetime columns.
+    """
+    if not isinstance(value, numbers.Real) or isinstance(value, bool):
+        value = str(value)
+    Variable.set(key, {'column': column, 'value': value}, serialize_json=True)
+
+
+def range_condition(column, lower, upper, quote=_quote_ident):
+    """
+    Returns a (sql, parameters) filter selecting lower <= column < upper.
+    A missing lower bound also selects NULLs so that a set of ranges
+    from MySqlHook.get_split_ranges covers every row exactly once.
+    :param quote: identifier quoting of the database the filter runs on
+    """
+    col = quote(column)
+    if lower is None and upper is None:
+        return '1 = 1', ()
+    if lower is None:
+        return '({col} < %s OR {col} IS NULL)'.format(col=col), (upper, )
+    if upper is None:
+        return '{col} >= %s'.format(col=col), (lower, )
+    return '{col} >= %s AND {col} < %s'.format(col=col), (lower, upper)
+
+
+def non_empty(chunks):
+    """
+    Drops the empty DataFrames or RecordBatches of a chunk stream.
+    """
+    return (chunk for chunk in chunks if len(chunk))
+
+
+class ChunkPipeline(object):
+    """
+    Bounded queue between reader threads, each draining one chunk stream,
+    and writer threads consuming chunks. Readers block while the queue is
+    full, which throttles extraction to the pace of the load.
+    An error on either side stops the pipeline and is raised again in the
+    writers.
+    :param queue_depth: maximum number of chunks waiting in the queue
+    :type queue_depth: int
+    :param readers: number of streams that will be read
+    :type readers: int
+    :param writers: number of consumers
+    :type writers: int
+    """
+
+    poll_interval = 0.1
+
+    def __init__(self, queue_depth, readers, writers):
+        self.queue = queue.Queue(maxsize=max(queue_depth, 1))
+        self.writers = writers
+        self.readers_left = readers
+        self.stopped = threading.Event()
+        self.error = None
+        self.lock = threading.Lock()
+        # Seconds readers waited on a full queue (target bound) and writers
+        # waited on an empty one (source bound).
+        self.read_wait = 0.0
+        self.write_wait = 0.0
+
+    def stop(self, error=None):
+        with self.lock:
+            if error is not None and self.error is None:
+                self.error = error
+        self.stopped.set()
+
+    def put(self, item):
+        start = time.time()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    self.queue.put(item, timeout=self.poll_interval)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            with self.lock:
+                self.read_wait += time.time() - start
+
+    def read(self, stream):
+        """
+        Pushes every chunk of stream into the queue. Run in a reader thread.
+        """
+        try:
+            for chunk in stream:
+                if not self.put(chunk):
+                    break
+        except BaseException as error:
+            self.stop(error)
+        finally:
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                close()
+            with self.lock:
+                self.readers_left -= 1
+                last = self.readers_left == 0
+            if last:
+                for _ in range(self.writers):
+                    self.put(_END)
+
+    def consume(self):
+        """
+        Yields chunks until every reader is done or the pipeline stopped.
+        """
+        while True:
+            start = time.time()
+            try:
+                item = self.queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                item = None
+            finally:
+                with self.lock:
+                    self.write_wait += time.time() - start
+            if item is _END:
+                break
+            if item is None:
+                if self.stopped.is_set():
+                    break
+                continue
+            yield item
+        if self.error is not None:
+            raise self.error
+
+
+class TableTransfer(LoggingMixin):
+    """
+    Streams table_from out of source_hook and loads it into table_to through
+    target_hook.load_frames.
+    :param source_hook: MySqlHook of the source database
+    :param target_hook: MySqlHook or PSqlHook of the target database
+    :param table_from: source table
+    :type table_from: string
+    :param table_to: target table
+    :type table_to: string
+    :param if_exists: pandas if_exists applied to the target table, or
+                      'merge' to upsert the rows on merge_keys
+    :type if_exists: string
+    :param chunk_rows: rows per extracted chunk
+    :type chunk_rows: int
+    :param load_method: load method of the target hook. 'arrow' extracts
+                        pyarrow RecordBatches instead of DataFrames.
+    :type load_method: string
+    :param parallelism: number of key ranges extracted and loaded concurrently
+    :type parallelism: int
+    :param split_column: column the ranges are computed on. Defaults to the
+                         first primary key column of the source table.
+    :type split_column: string
+    :param incremental_column: monotonic column (auto-increment id, updated_at
+                               timestamp) used to transfer only new rows.
+    :type incremental_column: string
+    :param watermark_key: Variable key holding the last transferred value of
+                          incremental_column. Required with incremental_column.
+    :type watermark_key: string
+    :param merge_keys: key columns of the target table for if_exists 'merge'
+    :type merge_keys: list
+    :param queue_depth: chunks buffered between extraction and loading
+    :type queue_depth: int
+    :param load_workers: threads loading chunks from the queue. Defaults to
+                         one per extracted stream.
+    :type load_workers: int
+    :param checksum_chunks: re-sync an existing target by comparing this many
+                            key ranges and only copying those that differ.
+                            A missing target is transferred in full.
+    :type checksum_chunks: int
+    :param metrics: TaskMetrics receiving the extract and load phases
+    :type metrics: TaskMetrics
+    """
+
+    def __init__(self,
+                 source_hook,
+                 target_hook,
+                 table_from,
+                 table_to,
+                 if_exists='append',
+                 chunk_rows=10000,
+                 load_method='insert',
+                 parallelism=1,
+                 split_column=None,
+                 incremental_column=None,
+                 watermark_key=None,
+                 merge_keys=None,
+                 queue_depth=4,
+                 load_workers=None,
+                 checksum_chunks=None,
+                 metrics=None):
+        self.source_hook = source_hook
+        self.target_hook = target_hook
+        self.table_from = table_from
+        self.table_to = table_to
+        self.if_exists = if_exists
+        self.chunk_rows = chunk_rows
+        self.load_method = load_method
+        self.parallelism = parallelism
+        self.split_column = split_column
+        self.incremental_column = incremental_column
+        self.watermark_key = watermark_key
+        self.merge_keys = merge_keys
+        self.queue_depth = queue_depth
+        self.load_workers = load_workers
+        self.checksum_chunks = checksum_chunks
+        self.metrics = metrics
+        self.where = None
+        self.where_parameters = ()
+
+        if incremental_column and not watermark_key:
+            raise AirflowException('watermark_key is required with incremental_column.')
+        if incremental_column and checksum_chunks:
+            raise AirflowException('incremental_column and checksum_chunks cannot be combined.')
+
+    def get_split_column(self):
+        if self.split_column:
+            return self.split_column
+        key = self.source_hook.get_primary_key(self.table_from)
+        if not key:
+            raise AirflowException('Table {0} has no primary key, '
+                                   'set split_column to extract it in parallel.'.format(self.table_from))
+        return key[0]
+
+    def iter_range(self, column, lower, upper):
+        condition, parameters = range_condition(column, lower, upper)
+        query = 'select * from ' + self.table_from + ' where ' + condition
+        if self.where:
+            query += ' and (' + self.where + ')'
+            parameters = tuple(parameters) + tuple(self.where_parameters)
+        return self.extract(query, parameters)
+
+    def extract(self, query, parameters=None):
+        if self.load_method == 'arrow':
+            chunks = self.source_hook.iter_record_batches(query, self.chunk_rows, parameters=parameters)
+        else:
+            chunks = self.source_hook.iter_chunks(query, self.chunk_rows, parameters=parameters, as_frame=True)
+        if self.metrics is not None:
+            return self.metrics.track(chunks)
+        return chunks
+
+    def run(self):
+        """
+        Runs the transfer, logs its throughput and returns the number of rows loaded.
+        """
+        start = time.time()
+        if self.incremental_column:
+            rows = self.transfer_incremental()
+        elif self.checksum_chunks:
+            rows = self.transfer_changed_chunks()
+        else:
+            rows = self.transfer()
+        elapsed = time.time() - start
+        self.log.info('Loaded %s rows from %s into %s with %s in %.1fs (%.0f rows/s), peak RSS %.1f MiB',
+                      rows, self.table_from, self.table_to, self.load_method, elapsed,
+                      rows / elapsed if elapsed else 0,
+                      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+        return rows
+
+    def transfer_incremental(self):
+        """
+        Transfers the rows past the stored watermark and returns their count.
+        In incremental mode the first run loads every row up to the current
+        MAX(incremental_column) with if_exists, later runs append the rows
+        past the stored mark. The mark only advances after the load succeeded.
+        """
+        column = _quote_ident(self.incremental_column)
+        high = self.source_hook.get_first(
+            'select max({col}) from {table}'.format(col=column, table=self.table_from))[0]
+        if high is None:
+            self.log.info('%s is empty, nothing to transfer.', self.table_from)
+            return 0
+
+        low = get_watermark(self.watermark_key, self.incremental_column)
+        if low is None:
+            self.log.info('No watermark for %s, loading every row up to %s.', self.incremental_column, high)
+            self.where, self.where_parameters = column + ' <= %s', (high, )
+        else:
+            self.log.info('Loading rows with %s in (%s, %s].', self.incremental_column, low, high)
+            self.where, self.where_parameters = column + ' > %s and ' + column + ' <= %s', (low, high)
+            if self.if_exists != 'merge':
+                self.if_exists = 'append'
+
+        rows = self.transfer()
+        set_watermark(self.watermark_key, self.incremental_column, high)
+        self.log.info('Transferred %s rows, watermark advanced to %s.', rows, high)
+        return rows
+
+    def chunk_checksums(self, columns, lower, upper):
+        source_where, source_parameters = range_condition(self.split_column, lower, upper)
+        target_where, target_parameters = range_condition(self.split_column, lower, upper,
+                                                          quote=self.target_hook.quote_identifier)
+        return (self.source_hook.get_checksum(self.table_from, columns, source_where, source_parameters),
+                self.target_hook.get_checksum(self.table_to, columns, target_where, target_parameters))
+
+    def transfer_changed_chunks(self):
+        """
+        Compares (row count, checksum) of every key range of the source and
+        the existing target, then replaces the target rows of the ranges that
+        differ. Returns the number of rows copied.
+        Values whose text form differs between the databases (e.g. floats in
+        exponent notation) make their chunk look changed, so it is copied
+        again; a chunk is never skipped because of that.
+        A missing target (the first run) is loaded in full with if_exists.
+        """
+        if not self.target_hook.has_table(self.table_to):
+            self.log.info('%s does not exist yet, transferring every row.', self.table_to)
+            return self.transfer()
+        self.split_column = self.get_split_column()
+        columns = self.source_hook.get_columns(self.table_from)
+        ranges = self.source_hook.get_split_ranges(self.table_from, self.split_column, self.checksum_chunks)
+        with ThreadPoolExecutor(max_workers=max(self.parallelism, 1)) as pool:
+            checksums = list(pool.map(lambda bounds: self.chunk_checksums(columns, *bounds), ranges))
+        changed = [bounds for bounds, (source, target) in zip(ranges, checksums) if source != target]
+        self.log.info('%s of %s chunks of %s differ from %s', len(changed), len(ranges),
+                      self.table_from, self.table_to)
+
+        with ThreadPoolExecutor(max_workers=max(self.parallelism, 1)) as pool:
+            return sum(pool.map(lambda bounds: self.replace_chunk(*bounds), changed))
+
+    def replace_chunk(self, lower, upper):
+        # The delete and the reload are separate transactions, readers of the
+        # target may briefly miss the rows of the chunk.
+        where, parameters = range_condition(self.split_column, lower, upper,
+                                            quote=self.target_hook.quote_identifier)
+        self.target_hook.run('DELETE FROM ' + self.table_to + ' WHERE ' + where, parameters=parameters)
+        return self.load(self.iter_range(self.split_column, lower, upper), 'append')
+
+    def load(self, chunks, if_exists):
+        if self.metrics is None:
+            return self.target_hook.load_frames(chunks, self.table_to, if_exists=if_exists,
+                                                load_method=self.load_method, merge_keys=self.merge_keys)
+        with self.metrics.consuming(chunks) as chunks:
+            return self.target_hook.load_frames(chunks, self.table_to, if_exists=if_exists,
+                                                load_method=self.load_method, merge_keys=self.merge_keys)
+
+    def transfer(self):
+        if self.parallelism <= 1:
+            query = 'select * from ' + self.table_from
+            if self.where:
+                query += ' where ' + self.where
+            streams = [self.extract(query, self.where_parameters or None)]
+        else:
+            column = self.get_split_column()
+            ranges = self.source_hook.get_split_ranges(self.table_from, column, self.parallelism)
+            self.log.info('Extracting %s in %s ranges of %s: %s', self.table_from, len(ranges), column, ranges)
+            streams = [self.iter_range(column, lower, upper) for lower, upper in ranges]
+
+        writers = self.load_workers or len(streams)
+        pipeline = ChunkPipeline(self.queue_depth, len(streams), writers)
+        if_exists = 'merge' if self.if_exists == 'merge' else 'append'
+        with ThreadPoolExecutor(max_workers=len(streams) + writers) as pool:
+            for stream in streams:
+                pool.submit(pipeline.read, stream)
+            try:
+                # The first non-empty chunk creates or replaces the target:
+                # an empty range arrives first and has no column types.
+                chunks = pipeline.consume()
+                first = empty = None
+                for chunk in chunks:
+                    if len(chunk):
+                        first = chunk
+                        break
+                    if empty is None:
+                        empty = chunk
+                if first is None:
+                    return self.load([empty], self.if_exists) if empty is not None else 0
+                if writers == 1:
+                    rows = self.load(itertools.chain([first], non_empty(chunks)), self.if_exists)
+                else:
+                    # The writers then append (or merge) concurrently.
+                    rows = self.load([first], self.if_exists)
+                    futures = [pool.submit(self.load, non_empty(pipeline.consume()), if_exists)
+                               for _ in range(writers)]
+                    rows += sum(future.result() for future in futures)
+            except BaseException as error:
+                pipeline.stop(error)
+                raise
+        self.log.info('Pipeline waits: extraction blocked on the load for %.1fs, '
+                      'loading starved by the extraction for %.1fs',
+                      pipeline.read_wait, pipeline.write_wait)
+        return rows
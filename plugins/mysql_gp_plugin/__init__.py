@@ -3,16 +3,18 @@ from mysql_gp_plugin.hooks.mysql_hook import MySqlHook
 from mysql_gp_plugin.hooks.psql_hook import PSqlHook
 from mysql_gp_plugin.operators.mysql_query_operator import MySqlQueryOperator
 from mysql_gp_plugin.operators.mysql_to_csv_operator import MySqlToCsvOperator
+from mysql_gp_plugin.operators.mysql_to_parquet_operator import MySqlToParquetOperator
 from mysql_gp_plugin.operators.mysql_to_mysql_operator import MySqlToMySqlOperator
 from mysql_gp_plugin.operators.mysql_to_psql_operator import MySqlToPSqlOperator
+from mysql_gp_plugin.operators.mysql_to_psql_replication_operator import MySqlToPSqlReplicationOperator
 from mysql_gp_plugin.operators.embulk_operator import EmbulkOperator
 
 
 class MySqlGPPlugin(AirflowPlugin):
     name = "mysql_gp_plugin"
     hooks = [MySqlHook, PSqlHook]
-    operators = [MySqlQueryOperator, MySqlToCsvOperator, EmbulkOperator,\
-                 MySqlToMySqlOperator, MySqlToPSqlOperator]
+    operators = [MySqlQueryOperator, MySqlToCsvOperator, MySqlToParquetOperator, EmbulkOperator,\
+                 MySqlToMySqlOperator, MySqlToPSqlOperator, MySqlToPSqlReplicationOperator]
     executors = []
     macros = []
     admin_views = []
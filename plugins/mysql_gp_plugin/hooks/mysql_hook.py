@@ -5,12 +5,44 @@
 # Based of https://airflow.readthedocs.io/en/latest/_modules/airflow/hooks/mysql_hook.html
 # 
 
+import codecs
+import itertools
+import numbers
+import os
+import shutil
+import tempfile
+import threading
 import MySQLdb
 import MySQLdb.cursors
+import pandas as pd
+from collections import OrderedDict
+from contextlib import closing, contextmanager
 
 from airflow.hooks.dbapi_hook import DbApiHook
 from airflow.plugins_manager import AirflowPlugin
-from sqlalchemy import create_engine
+from sqlalchemy.types import String, Text
+from google_analytics_plugin.hooks.batched_insert import BatchedInsert
+from google_analytics_plugin.hooks.engine_registry import get_engine, pool_options
+from google_analytics_plugin.hooks.result_cache import cached_query
+from google_analytics_plugin.hooks.text_format import TextRowStream, escape_text
+
+# MySQL charset names that differ from their python codec.
+_PYTHON_ENCODINGS = {
+    'utf8': 'utf-8',
+    'utf8mb3': 'utf-8',
+    'utf8mb4': 'utf-8',
+    'latin1': 'cp1252',
+}
+
+# Staging column numbering the merged rows in load order.
+_MERGE_SEQUENCE = '_merge_seq'
+
+# Deprecation warnings (e.g. the utf8 alias) raised by a statement, not by its rows.
+_DEPRECATION_WARNINGS = (1287, 3719)
+
+
+def _quote_ident(name):
+    return '`' + str(name).replace('`', '``') + '`'
 
 
 class MySqlHook(DbApiHook):
@@ -18,6 +50,11 @@ class MySqlHook(DbApiHook):
     conn_name_attr = 'mysql_conn_id'
     default_conn_name = 'mysql_default'
     supports_autocommit = True
+    load_methods = ('insert', 'batched', 'load_data')
+    insert_batch_rows = 1000
+    insert_batch_bytes = 4 * 1024 * 1024
+    pipe_buffer_size = 1024 * 1024
+    quote_identifier = staticmethod(_quote_ident)
 
     def __init__(self, *args, **kwargs):
         super(MySqlHook, self).__init__(*args, **kwargs)
@@ -37,7 +74,15 @@ class MySqlHook(DbApiHook):
 
     def get_conn(self):
         """
-           Returns a sqlalchemy mysql connection object
+           Returns a sqlalchemy mysql connection object checked out of the
+           shared engine pool. Close it to hand it back to the pool.
+        """
+        return self.get_sqlalchemy_engine().connect()
+
+    def get_sqlalchemy_engine(self, engine_kwargs=None):
+        """
+           Returns the process-wide sqlalchemy engine for this connection,
+           schema and charset. Pool settings come from the connection extras.
         """
         conn = self.get_connection(self.mysql_conn_id)
         conn_config = {
@@ -65,44 +110,589 @@ class MySqlHook(DbApiHook):
         #        conn_config["cursorclass"] = MySQLdb.cursors.DictCursor
         #    elif (conn.extra_dejson["cursor"]).lower() == 'ssdictcursor':
         #        conn_config["cursorclass"] = MySQLdb.cursors.SSDictCursor
-        #local_infile = conn.extra_dejson.get('local_infile', False)
+        local_infile = conn.extra_dejson.get('local_infile', False)
         #if conn.extra_dejson.get('ssl', False):
         #    conn_config['ssl'] = conn.extra_dejson['ssl']
         #if conn.extra_dejson.get('unix_socket'):
         #    conn_config['unix_socket'] = conn.extra_dejson['unix_socket']
-        #if local_infile:
-        #    conn_config["local_infile"] = 1
+        if local_infile:
+            conn_config["local_infile"] = 1
+
+        sql_alchemy_uri = "mysql://" + str(conn_config["user"]) + ":" + str(conn_config["passwd"]) + "@" + \
+                          str(conn_config["host"]) + ":" + str(conn_config["port"]) + "/" + \
+                          str(conn_config["db"]) + charset_str
+        engine_options = pool_options(conn.extra_dejson)
+        if local_infile:
+            engine_options["connect_args"] = {"local_infile": 1}
+        engine_options.update(engine_kwargs or {})
+        key = (self.mysql_conn_id, conn_config["db"], conn_config.get("charset", "utf8"))
+
+        return get_engine(key, sql_alchemy_uri, **engine_options)
+
+    @contextmanager
+    def server_side_cursor(self, sql, parameters=None):
+        """
+        Executes sql on an unbuffered server-side cursor (SSCursor) and yields
+        the cursor. Rows are pulled from the server as they are fetched, so
+        client memory does not grow with the size of the result set.
+        :param sql: the sql statement to be executed
+        :type sql: str
+        :param parameters: the parameters to render the sql query with
+        :type parameters: tuple or dict
+        """
+        conn = self.get_sqlalchemy_engine().raw_connection()
+        try:
+            with closing(conn.cursor(MySQLdb.cursors.SSCursor)) as cur:
+                cur.execute(sql, parameters)
+                yield cur
+        finally:
+            conn.close()
+
+    def iter_chunks(self, sql, chunk_rows=10000, parameters=None, as_frame=False):
+        """
+        Streams the result of sql in batches of at most chunk_rows rows.
+        :param sql: the sql statement to be executed
+        :type sql: str
+        :param chunk_rows: maximum number of rows per batch
+        :type chunk_rows: int
+        :param parameters: the parameters to render the sql query with
+        :type parameters: tuple or dict
+        :param as_frame: yield pandas DataFrames instead of lists of tuples.
+                         At least one (possibly empty) DataFrame is always
+                         yielded so callers can rely on the column layout.
+        :type as_frame: bool
+        """
+        with self.server_side_cursor(sql, parameters) as cur:
+            columns = [col[0] for col in cur.description]
+            emitted = False
+            while True:
+                rows = cur.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                emitted = True
+                if as_frame:
+                    yield pd.DataFrame.from_records(list(rows), columns=columns)
+                else:
+                    yield rows
+            if as_frame and not emitted:
+                yield pd.DataFrame(columns=columns)
+
+    def cached(self, sql, parameters, cache_ttl, compute):
+        """
+        Returns compute() through the on-disk result cache when cache_ttl is set.
+        """
+        return cached_query(getattr(self, self.conn_name_attr), self.schema, sql, parameters, cache_ttl, compute)
+
+    def get_records(self, sql, parameters=None, cache_ttl=None):
+        """
+        Executes the sql and returns a set of records.
+        :param sql: the sql statement to be executed
+        :type sql: str
+        :param parameters: the parameters to render the sql query with
+        :type parameters: tuple or dict
+        :param cache_ttl: seconds to serve the records from the result cache
+        :type cache_ttl: int
+        """
+        def fetch():
+            with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
+                with closing(conn.cursor()) as cur:
+                    cur.execute(sql, parameters)
+                    return cur.fetchall()
+        return self.cached(sql, parameters, cache_ttl, fetch)
+
+    def get_pandas_df(self, sql, parameters=None, cache_ttl=None):
+        """
+        Executes the sql and returns a pandas dataframe.
+        :param sql: the sql statement to be executed
+        :type sql: str
+        :param parameters: the parameters to render the sql query with
+        :type parameters: tuple or dict
+        :param cache_ttl: seconds to serve the dataframe from the result cache
+        :type cache_ttl: int
+        """
+        def fetch():
+            with closing(self.get_conn()) as conn:
+                return pd.read_sql(sql, conn, params=parameters)
+        return self.cached(sql, parameters, cache_ttl, fetch)
+
+    def get_first(self, sql, parameters=None):
+        """
+        Executes the sql and returns the first resulting row.
+        :param sql: the sql statement to be executed
+        :type sql: str
+        :param parameters: the parameters to render the sql query with
+        :type parameters: tuple or dict
+        """
+        with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
+            with closing(conn.cursor()) as cur:
+                cur.execute(sql, parameters)
+                return cur.fetchone()
+
+    def run(self, sql, autocommit=False, parameters=None):
+        """
+        Executes one statement or a list of statements in a single transaction.
+        :param sql: the sql statement(s) to be executed
+        :type sql: str or list
+        :param parameters: the parameters to render the sql query with
+        :type parameters: tuple or dict
+        """
+        if isinstance(sql, str):
+            sql = [sql]
+        with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
+            try:
+                with closing(conn.cursor()) as cur:
+                    for statement in sql:
+                        cur.execute(statement, parameters)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def get_columns(self, table):
+        """
+        Returns the columns of table in ordinal order.
+        :param table: table name, optionally prefixed with its database
+        :type table: str
+        :rtype list
+        """
+        schema, _, name = table.rpartition('.')
+        rows = self.get_records(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND TABLE_NAME = %s "
+            "ORDER BY ORDINAL_POSITION",
+            (schema.strip('`') or None, name.strip('`')))
+        return [row[0] for row in rows]
+
+    def get_checksum(self, table, columns, where='1 = 1', parameters=None):
+        """
+        Returns (row count, checksum) of the rows of table matching where.
+        The checksum is the sum of the first 60 bits of the MD5 of every row,
+        its non-NULL columns joined by '#'. PSqlHook.get_checksum computes the
+        same value for rows with the same text representation.
+        :param columns: columns covered by the checksum
+        :type columns: list
+        :param where: filter of the rows, using quote_identifier
+        :type where: str
+        :rtype tuple
+        """
+        row = self.get_first(
+            "SELECT COUNT(*), COALESCE(SUM(CAST(CONV(SUBSTRING(MD5(CONCAT_WS('#', {columns})), 1, 15), 16, 10) "
+            "AS UNSIGNED)), 0) FROM {table} WHERE {where}".format(
+                columns=', '.join(_quote_ident(col) for col in columns), table=table, where=where),
+            parameters)
+        return int(row[0]), int(row[1])
+
+    def get_primary_key(self, table):
+        """
+        Returns the primary key columns of table in key order.
+        :param table: table name, optionally prefixed with its database
+        :type table: str
+        :rtype list
+        """
+        schema, _, name = table.rpartition('.')
+        rows = self.get_records(
+            "SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE "
+            "WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND TABLE_NAME = %s "
+            "AND CONSTRAINT_NAME = 'PRIMARY' ORDER BY ORDINAL_POSITION",
+            (schema.strip('`') or None, name.strip('`')))
+        return [row[0] for row in rows]
+
+    def has_table(self, table, schema=None):
+        """
+        Tells whether table exists in schema, the connection database by default.
+        """
+        return bool(self.get_first(
+            "SELECT COUNT(*) FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND TABLE_NAME = %s",
+            (schema, table))[0])
 
-        sql_alchemy_uri = "mysql://" + str(conn.login) + ":" + str(conn.password) + "@" + str(conn.host) + \
-                          "/" + str(conn.schema) + charset_str
-        engine = create_engine(sql_alchemy_uri)
-        conn = engine.connect()
+    def get_unique_keys(self, table, schema=None):
+        """
+        Returns the columns of every primary or unique key of table.
+        :rtype list
+        """
+        rows = self.get_records(
+            "SELECT INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND TABLE_NAME = %s AND NON_UNIQUE = 0 "
+            "ORDER BY INDEX_NAME, SEQ_IN_INDEX",
+            (schema, table))
+        keys = OrderedDict()
+        for index, column in rows:
+            keys.setdefault(index, []).append(column)
+        return list(keys.values())
 
-        return conn
+    def prepare_merge_target(self, frame, table, merge_keys, schema=None, dtype=None):
+        """
+        Creates table from the columns of frame with a primary key on
+        merge_keys when it does not exist. An existing table must have a
+        primary or unique key made of merge_keys, else ON DUPLICATE KEY UPDATE
+        would never match and the merge would append.
+        String key columns are created as VARCHAR(255), TEXT cannot be a key.
+        """
+        missing = [key for key in merge_keys if key not in frame.columns]
+        if missing:
+            raise ValueError('merge_keys {0} are not columns of the frames'.format(missing))
+        target = _quote_ident(table)
+        if schema:
+            target = _quote_ident(schema) + "." + target
+        if not self.has_table(table, schema):
+            dtype = dict(dtype or {})
+            for key in merge_keys:
+                if isinstance(dtype.get(key), Text) or (key not in dtype and frame[key].dtype == object):
+                    dtype[key] = String(255)
+            frame.head(0).to_sql(table, self.get_sqlalchemy_engine(), schema=schema, if_exists='fail', index=False,
+                                 dtype=dtype)
+            self.run("ALTER TABLE {0} ADD PRIMARY KEY ({1})".format(
+                target, ", ".join(_quote_ident(key) for key in merge_keys)))
+        elif not any(set(key) == set(merge_keys) for key in self.get_unique_keys(table, schema)):
+            raise ValueError('{0} has no primary or unique key on merge_keys {1}'.format(target, merge_keys))
+
+    def get_table_sizes(self, schema=None):
+        """
+        Returns (table, estimated rows, data + index bytes) for the base tables
+        of schema, the connection database by default. The figures are the
+        InnoDB statistics of information_schema, not exact counts.
+        :param schema: database to list
+        :type schema: str
+        :rtype list
+        """
+        rows = self.get_records(
+            "SELECT TABLE_NAME, COALESCE(TABLE_ROWS, 0), "
+            "COALESCE(DATA_LENGTH, 0) + COALESCE(INDEX_LENGTH, 0) FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND TABLE_TYPE = 'BASE TABLE'",
+            (schema, ))
+        return [(row[0], int(row[1]), int(row[2])) for row in rows]
+
+    def get_split_ranges(self, table, column, num_ranges):
+        """
+        Splits the values of column into at most num_ranges contiguous
+        (lower, upper) bounds holding roughly the same number of rows.
+        Numeric columns are split evenly between MIN and MAX, other columns
+        at quantile boundaries read along the column's index.
+        The first range has no lower bound and the last no upper bound, so
+        together they cover every row.
+        :param table: table name
+        :type table: str
+        :param column: split column, ideally indexed
+        :type column: str
+        :param num_ranges: number of ranges wanted
+        :type num_ranges: int
+        :rtype list
+        """
+        col = _quote_ident(column)
+        low, high = self.get_first("SELECT MIN({col}), MAX({col}) FROM {table}".format(col=col, table=table))
+        if num_ranges <= 1 or low is None or low == high:
+            return [(None, None)]
+
+        if isinstance(low, numbers.Integral):
+            bounds = [low + (high - low) * i // num_ranges for i in range(1, num_ranges)]
+        elif isinstance(low, numbers.Number):
+            bounds = [low + (high - low) * i / num_ranges for i in range(1, num_ranges)]
+        else:
+            count = self.get_first("SELECT COUNT({col}) FROM {table}".format(col=col, table=table))[0]
+            sql = "SELECT {col} FROM {table} WHERE {col} IS NOT NULL ORDER BY {col} LIMIT 1 OFFSET %s".format(
+                col=col, table=table)
+            bounds = [self.get_first(sql, (count * i // num_ranges, ))[0] for i in range(1, num_ranges)]
+
+        bounds = sorted(set(bound for bound in bounds if low < bound <= high))
+        edges = [None] + bounds + [None]
+        return list(zip(edges[:-1], edges[1:]))
+
+    def get_charset(self):
+        """
+        Returns the MySQL charset of the connection, utf8mb4 unless set in the extras.
+        utf8 is deprecated as an alias of utf8mb3 since MySQL 8.0 and read as utf8mb4.
+        """
+        charset = self.get_connection(self.mysql_conn_id).extra_dejson.get('charset') or 'utf8mb4'
+        if charset.lower() in ('utf8', 'utf-8'):
+            charset = 'utf8mb4'
+        return charset
+
+    def iter_record_batches(self, sql, chunk_rows=10000, parameters=None):
+        """
+        Streams the result of sql as pyarrow RecordBatches of at most
+        chunk_rows rows, typed from the cursor description. At least one
+        (possibly empty) batch is always yielded. Requires pyarrow.
+        :param sql: the sql statement to be executed
+        :type sql: str
+        :param chunk_rows: maximum number of rows per batch
+        :type chunk_rows: int
+        :param parameters: the parameters to render the sql query with
+        :type parameters: tuple or dict
+        """
+        from google_analytics_plugin.hooks.arrow_format import rows_to_record_batch, schema_from_description
+
+        with self.server_side_cursor(sql, parameters) as cur:
+            rows = cur.fetchmany(chunk_rows)
+            schema = schema_from_description(cur.description, rows, getattr(cur, 'description_flags', None))
+            yield rows_to_record_batch(rows, schema)
+            while rows:
+                rows = cur.fetchmany(chunk_rows)
+                if rows:
+                    yield rows_to_record_batch(rows, schema)
 
     def bulk_load(self, table, tmp_file):
         """
         Loads a tab-delimited file into a database table
         """
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute("""
-            LOAD DATA LOCAL INFILE '{tmp_file}'
-            INTO TABLE {table}
-            """.format(**locals()))
-        conn.commit()
+        with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
+            with closing(conn.cursor()) as cur:
+                cur.execute("LOAD DATA LOCAL INFILE %s INTO TABLE " + table, (tmp_file, ))
+            conn.commit()
 
     def bulk_dump(self, table, tmp_file):
         """
         Dumps a database table into a tab-delimited file
         """
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT * INTO OUTFILE '{tmp_file}'
-            FROM {table}
-            """.format(**locals()))
-        conn.commit()
+        with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
+            with closing(conn.cursor()) as cur:
+                cur.execute("SELECT * INTO OUTFILE %s FROM " + table, (tmp_file, ))
+            conn.commit()
+
+    def load_rows(self, table, batches, columns=None, schema=None, conn=None):
+        """
+        Streams row batches into table with LOAD DATA LOCAL INFILE.
+        The rows are written into a named pipe by a writer thread while the
+        server reads from it, so no complete file is ever written to disk.
+        Requires "local_infile": true in the connection extras and
+        local_infile enabled on the server.
+        :param table: target table
+        :type table: str
+        :param batches: iterable of DataFrames or sequences of row tuples
+        :type batches: iterable
+        :param columns: target columns in row order, all columns if None
+        :type columns: list
+        :param schema: database of the target table
+        :type schema: str
+        :param conn: raw MySQLdb connection to run on. When given, the caller
+                     owns the transaction and nothing is committed here.
+        :type conn: connection object
+        :return: number of rows loaded
+        :rtype int
+        """
+        # With LOCAL, conversion and duplicate-key errors only raise warnings
+        # and the load goes on with truncated or zeroed values.
+        charset = self.get_charset()
+        encoding = _PYTHON_ENCODINGS.get(charset.lower(), charset)
+        codecs.lookup(encoding)
+
+        target = _quote_ident(table)
+        if schema:
+            target = _quote_ident(schema) + "." + target
+        sql = ("LOAD DATA LOCAL INFILE %s INTO TABLE " + target +
+               " CHARACTER SET " + charset +
+               " FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'")
+        if columns:
+            sql += " (" + ", ".join(_quote_ident(col) for col in columns) + ")"
+
+        # bytes round-trip unchanged through the pipe's surrogateescape encoding
+        stream = TextRowStream(batches, true='1', false='0',
+                               bytes_format=lambda value: escape_text(value.decode(encoding, 'surrogateescape')))
+        tmp_dir = tempfile.mkdtemp(prefix='airflow_load_')
+        pipe_path = os.path.join(tmp_dir, 'rows.pipe')
+        os.mkfifo(pipe_path)
+        errors = []
+        warnings = []
+        cancelled = threading.Event()
+
+        def write_pipe():
+            try:
+                with open(pipe_path, 'w', encoding=encoding, errors='surrogateescape', newline='') as pipe:
+                    data = stream.read(self.pipe_buffer_size)
+                    while data and not cancelled.is_set():
+                        pipe.write(data)
+                        data = stream.read(self.pipe_buffer_size)
+            except BaseException as e:
+                errors.append(e)
+
+        writer = threading.Thread(target=write_pipe, name='load_rows_writer')
+        writer.daemon = True
+        owns_conn = conn is None
+        if owns_conn:
+            conn = self.get_sqlalchemy_engine().raw_connection()
+        try:
+            writer.start()
+            try:
+                with closing(conn.cursor()) as cur:
+                    cur.execute(sql, (pipe_path, ))
+                    if conn.warning_count():
+                        cur.execute("SHOW WARNINGS LIMIT 10")
+                        warnings.extend(row for row in cur.fetchall()
+                                        if row[0] != 'Note' and int(row[1]) not in _DEPRECATION_WARNINGS)
+            finally:
+                if writer.is_alive():
+                    # The server never opened the pipe or stopped reading it:
+                    # stop the writer and drain the pipe until it exits.
+                    cancelled.set()
+                    fd = os.open(pipe_path, os.O_RDONLY | os.O_NONBLOCK)
+                    try:
+                        while writer.is_alive():
+                            try:
+                                os.read(fd, self.pipe_buffer_size)
+                            except BlockingIOError:
+                                pass
+                            writer.join(0.1)
+                    finally:
+                        os.close(fd)
+                writer.join()
+            if errors:
+                raise errors[0]
+            if warnings:
+                raise ValueError('LOAD DATA into {0} raised warnings: {1}'.format(
+                    target, '; '.join('{0} {1}: {2}'.format(*row) for row in warnings)))
+            if owns_conn:
+                conn.commit()
+        except Exception:
+            if owns_conn:
+                conn.rollback()
+            raise
+        finally:
+            if owns_conn:
+                conn.close()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return stream.rows
+
+    def merge_frames(self, frames, table, merge_keys, schema=None, load_method='batched', dtype=None):
+        """
+        Upserts a stream of DataFrames into table. The rows are bulk-loaded
+        into a temporary staging table and merged with a single
+        INSERT ... SELECT ... ON DUPLICATE KEY UPDATE on the same connection.
+        Rows are matched on the unique keys of the target table, one of which
+        must be made of merge_keys; the other columns are updated. The staging
+        table has no keys and rows are merged in load order, so a key repeated
+        in the frames keeps its last row.
+        The table is created from the first frame with a primary key on
+        merge_keys if it does not exist yet.
+        :param frames: iterable of DataFrames sharing the same columns
+        :type frames: iterable
+        :param table: target table
+        :type table: str
+        :param merge_keys: columns identifying a row
+        :type merge_keys: list
+        :param schema: database of the target table
+        :type schema: str
+        :param load_method: 'load_data' stages with LOAD DATA LOCAL INFILE,
+                            anything else with multi-row INSERTs.
+        :type load_method: str
+        :param dtype: to_sql dtype of the columns of a created table
+        :type dtype: dict
+        :return: number of rows merged
+        :rtype int
+        """
+        frames = iter(frames)
+        first = next(frames, None)
+        if first is None:
+            return 0
+        self.prepare_merge_target(first, table, merge_keys, schema=schema, dtype=dtype)
+
+        columns = list(first.columns)
+        target = _quote_ident(table)
+        if schema:
+            target = _quote_ident(schema) + "." + target
+        staging = ('_merge_' + table)[:64]
+        column_list = ", ".join(_quote_ident(col) for col in columns)
+        seq = _quote_ident(_MERGE_SEQUENCE)
+        # new.col rather than VALUES(col), deprecated since MySQL 8.0.20.
+        updates = ", ".join("{0} = new.{0}".format(_quote_ident(col)) for col in columns if col not in merge_keys)
+        merge_sql = ("INSERT {ignore}INTO {target} ({columns}) SELECT {new_columns} FROM {staging} AS new "
+                     "ORDER BY new.{seq}").format(
+            ignore="" if updates else "IGNORE ", target=target, columns=column_list,
+            new_columns=", ".join("new." + _quote_ident(col) for col in columns), staging=_quote_ident(staging),
+            seq=seq)
+        if updates:
+            merge_sql += " ON DUPLICATE KEY UPDATE " + updates
+
+        with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
+            try:
+                with closing(conn.cursor()) as cur:
+                    # The target columns without their keys, numbered in load order.
+                    cur.execute("CREATE TEMPORARY TABLE {staging} ({seq} BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY) "
+                                "SELECT {columns} FROM {target} LIMIT 0".format(
+                                    staging=_quote_ident(staging), seq=seq, columns=column_list, target=target))
+                batches = itertools.chain([first], frames)
+                if load_method == 'load_data':
+                    rows = self.load_rows(staging, batches, columns=columns, conn=conn)
+                else:
+                    rows = 0
+                    insert = BatchedInsert(self.insert_batch_rows, self.insert_batch_bytes)
+                    insert_sql = "INSERT INTO {0} ({1}) VALUES ({2})".format(
+                        _quote_ident(staging), column_list, ", ".join(["%s"] * len(columns)))
+                    with closing(conn.cursor()) as cur:
+                        for df_ in batches:
+                            records = df_.astype(object).where(df_.notnull(), None).itertuples(index=False, name=None)
+                            for batch in insert.batches(records):
+                                cur.executemany(insert_sql, batch)
+                                rows += len(batch)
+                with closing(conn.cursor()) as cur:
+                    cur.execute(merge_sql)
+                    cur.execute("DROP TEMPORARY TABLE " + _quote_ident(staging))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                # Temporary tables live as long as the session, discard it
+                # instead of handing the staging table back to the pool.
+                conn.invalidate()
+                raise
+        return rows
+
+    def load_frames(self, frames, table, if_exists='append', load_method='insert', schema=None, merge_keys=None,
+                    dtype=None):
+        """
+        Writes a stream of DataFrames into table. Only the first frame applies
+        if_exists, the following ones are appended.
+        if_exists 'merge' upserts the rows on merge_keys with merge_frames.
+        load_method 'insert' writes every frame with pandas to_sql.
+        load_method 'batched' does the same with multi-row INSERTs bounded by
+        insert_batch_rows and insert_batch_bytes.
+        load_method 'load_data' creates or replaces the table from the first
+        frame's columns with to_sql and streams all rows through a single
+        LOAD DATA LOCAL INFILE.
+        :param frames: iterable of DataFrames sharing the same columns
+        :type frames: iterable
+        :param table: target table
+        :type table: str
+        :param if_exists: pandas to_sql if_exists for the first frame
+        :type if_exists: str
+        :param load_method: one of MySqlHook.load_methods
+        :type load_method: str
+        :param schema: database of the target table
+        :type schema: str
+        :param merge_keys: key columns for if_exists 'merge'
+        :type merge_keys: list
+        :param dtype: to_sql dtype of the columns of a created table, so that
+                      they do not depend on the values of the first frame
+        :type dtype: dict
+        :return: number of rows written
+        :rtype int
+        """
+        if load_method not in self.load_methods:
+            raise ValueError('Unknown load_method {0}, expected one of {1}'.format(load_method, self.load_methods))
+        if if_exists == 'merge':
+            if not merge_keys:
+                raise ValueError('merge_keys are required with if_exists="merge"')
+            return self.merge_frames(frames, table, merge_keys, schema=schema, load_method=load_method,
+                                     dtype=dtype)
+
+        engine = self.get_sqlalchemy_engine()
+        frames = iter(frames)
+        first = next(frames, None)
+        if first is None:
+            return 0
+
+        if load_method == 'load_data':
+            first.head(0).to_sql(table, engine, schema=schema, if_exists=if_exists, index=False, dtype=dtype)
+            return self.load_rows(table, itertools.chain([first], frames),
+                                  columns=list(first.columns), schema=schema)
+
+        method = None
+        if load_method == 'batched':
+            method = BatchedInsert(self.insert_batch_rows, self.insert_batch_bytes)
+        rows = 0
+        for df_ in itertools.chain([first], frames):
+            df_.to_sql(table, engine, schema=schema, if_exists=if_exists, index=False, method=method, dtype=dtype)
+            if_exists = 'append'
+            rows += len(df_)
+        return rows
 
     @staticmethod
     def _serialize_cell(cell, conn):
@@ -1,17 +1,31 @@
 # -*- coding: utf-8 -*-
 # Provides a sqlalchemy postgresql connection object 
 # Use get_conn method to use within plugins.
-# Specify charset through UI. utf-8 by default.
+# Specify charset through UI, it sets the client_encoding. Server default otherwise.
 # Based of https://github.com/apache/airflow/blob/master/airflow/hooks/postgres_hook.py
 # 
 
+import io
 import os
+import itertools
 import psycopg2
 import psycopg2.extensions
+from collections import OrderedDict
 from contextlib import closing
 
 from airflow.hooks.dbapi_hook import DbApiHook
-from sqlalchemy import create_engine
+from google_analytics_plugin.hooks.batched_insert import BatchedInsert
+from google_analytics_plugin.hooks.engine_registry import get_engine, pool_options
+from google_analytics_plugin.hooks.result_cache import cached_query
+from google_analytics_plugin.hooks.text_format import TextRowStream
+
+
+# Staging column numbering the merged rows in load order.
+_MERGE_SEQUENCE = '_merge_seq'
+
+
+def _quote_ident(name):
+    return '"' + str(name).replace('"', '""') + '"'
 
 
 class PSqlHook(DbApiHook):
@@ -21,6 +35,11 @@ class PSqlHook(DbApiHook):
     conn_name_attr = 'psql_conn_id'
     default_conn_name = 'psql_default'
     supports_autocommit = True
+    load_methods = ('insert', 'batched', 'copy', 'arrow')
+    insert_batch_rows = 1000
+    insert_batch_bytes = 4 * 1024 * 1024
+    copy_buffer_size = 1024 * 1024
+    quote_identifier = staticmethod(_quote_ident)
 
     def __init__(self, *args, **kwargs):
         super(PSqlHook, self).__init__(*args, **kwargs)
@@ -44,7 +63,15 @@ class PSqlHook(DbApiHook):
 
     def get_conn(self):
         """
-        Returns a psql connection object
+        Returns a psql connection object checked out of the shared engine
+        pool. Close it to hand it back to the pool.
+        """
+        return self.get_sqlalchemy_engine().connect()
+
+    def get_sqlalchemy_engine(self, engine_kwargs=None):
+        """
+        Returns the process-wide sqlalchemy engine for this connection,
+        schema and charset. Pool settings come from the connection extras.
         """
         conn = self.get_connection(self.psql_conn_id)
         conn_config = {
@@ -57,16 +84,14 @@ class PSqlHook(DbApiHook):
         }
 
         if not conn.port:
-            conn_config["port"] = 3306
+            conn_config["port"] = 5432
         else:
             conn_config["port"] = int(conn.port)
-        charset_str = "?charset=utf8"
+        # libpq has no charset option, a charset extra sets the client_encoding.
+        encoding_str = ""
         if conn.extra_dejson.get('charset', False):
-            charset_str = ""
             conn_config["charset"] = conn.extra_dejson["charset"]
-            if (conn_config["charset"]).lower() == 'utf8' or\
-                    (conn_config["charset"]).lower() == 'utf-8':
-                conn_config["use_unicode"] = True
+            encoding_str = "?client_encoding=" + conn_config["charset"].lower().replace('-', '')
         #if conn.extra_dejson.get('cursor', False):
         #    if (conn.extra_dejson["cursor"]).lower() == 'sscursor':
         #        conn_config["cursorclass"] = MySQLdb.cursors.SSCursor
@@ -83,12 +108,160 @@ class PSqlHook(DbApiHook):
         #    conn_config["local_infile"] = 1
 
         sql_alchemy_uri = "postgresql+psycopg2://" + str(conn.login) + ":" + str(conn.password) + "@" + str(conn.host) + ":" + \
-        str(conn_config["port"]) + "/" + str(conn.schema) + charset_str
-        engine = create_engine(sql_alchemy_uri)
-        conn = engine.connect()
+        str(conn_config["port"]) + "/" + str(conn_config["db"]) + encoding_str
+        engine_options = pool_options(conn.extra_dejson)
+        engine_options.update(engine_kwargs or {})
+        key = (self.psql_conn_id, conn_config["db"], conn_config.get("charset", "utf8"))
+
+        return get_engine(key, sql_alchemy_uri, **engine_options)
+
+
+    def cached(self, sql, parameters, cache_ttl, compute):
+        """
+        Returns compute() through the on-disk result cache when cache_ttl is set.
+        """
+        return cached_query(getattr(self, self.conn_name_attr), self.schema, sql, parameters, cache_ttl, compute)
+
+    def get_records(self, sql, parameters=None, cache_ttl=None):
+        """
+        Executes the sql and returns a set of records.
+        :param sql: the sql statement to be executed
+        :type sql: str
+        :param parameters: the parameters to render the sql query with
+        :type parameters: tuple or dict
+        :param cache_ttl: seconds to serve the records from the result cache
+        :type cache_ttl: int
+        """
+        def fetch():
+            with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
+                with closing(conn.cursor()) as cur:
+                    cur.execute(sql, parameters)
+                    return cur.fetchall()
+        return self.cached(sql, parameters, cache_ttl, fetch)
+
+    def get_pandas_df(self, sql, parameters=None, cache_ttl=None):
+        """
+        Executes the sql and returns a pandas dataframe.
+        :param sql: the sql statement to be executed
+        :type sql: str
+        :param parameters: the parameters to render the sql query with
+        :type parameters: tuple or dict
+        :param cache_ttl: seconds to serve the dataframe from the result cache
+        :type cache_ttl: int
+        """
+        import pandas as pd
 
-        return conn
+        def fetch():
+            with closing(self.get_conn()) as conn:
+                return pd.read_sql(sql, conn, params=parameters)
+        return self.cached(sql, parameters, cache_ttl, fetch)
+
+    def get_first(self, sql, parameters=None):
+        """
+        Executes the sql and returns the first resulting row.
+        :param sql: the sql statement to be executed
+        :type sql: str
+        :param parameters: the parameters to render the sql query with
+        :type parameters: tuple or dict
+        """
+        with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
+            with closing(conn.cursor()) as cur:
+                cur.execute(sql, parameters)
+                return cur.fetchone()
+
+    def get_column_types(self, table, schema=None):
+        """
+        Returns an ordered list of (column, data_type) of table.
+        """
+        return self.get_records(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = COALESCE(%s, current_schema()) AND table_name = %s "
+            "ORDER BY ordinal_position", (schema, table))
+
+    def has_table(self, table, schema=None):
+        """
+        Tells whether table exists in schema, the search path by default.
+        """
+        target = _quote_ident(table)
+        if schema:
+            target = _quote_ident(schema) + "." + target
+        return self.get_first("SELECT to_regclass(%s)", (target, ))[0] is not None
+
+    def get_unique_keys(self, table, schema=None):
+        """
+        Returns the columns of every primary key and non-partial unique index
+        of table, the indexes ON CONFLICT can infer.
+        :rtype list
+        """
+        target = _quote_ident(table)
+        if schema:
+            target = _quote_ident(schema) + "." + target
+        rows = self.get_records(
+            "SELECT i.indexrelid, a.attname FROM pg_index i "
+            "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+            "WHERE i.indrelid = %s::regclass AND i.indisunique AND i.indpred IS NULL "
+            "ORDER BY i.indexrelid, a.attnum", (target, ))
+        keys = OrderedDict()
+        for index, column in rows:
+            keys.setdefault(index, []).append(column)
+        return list(keys.values())
+
+    def prepare_merge_target(self, frame, table, merge_keys, schema=None, dtype=None):
+        """
+        Creates table from the columns of frame with a primary key on
+        merge_keys when it does not exist. An existing table must have a
+        primary key or unique index made of merge_keys for ON CONFLICT.
+        """
+        missing = [key for key in merge_keys if key not in frame.columns]
+        if missing:
+            raise ValueError('merge_keys {0} are not columns of the frames'.format(missing))
+        target = _quote_ident(table)
+        if schema:
+            target = _quote_ident(schema) + "." + target
+        if not self.has_table(table, schema):
+            frame.head(0).to_sql(table, self.get_sqlalchemy_engine(), schema=schema, if_exists='fail', index=False,
+                                 dtype=dtype)
+            self.run("ALTER TABLE {0} ADD PRIMARY KEY ({1})".format(
+                target, ", ".join(_quote_ident(key) for key in merge_keys)))
+        elif not any(set(key) == set(merge_keys) for key in self.get_unique_keys(table, schema)):
+            raise ValueError('{0} has no primary key or unique index on merge_keys {1}'.format(target, merge_keys))
+
+    def run(self, sql, autocommit=False, parameters=None):
+        """
+        Executes one statement or a list of statements in a single transaction.
+        :param sql: the sql statement(s) to be executed
+        :type sql: str or list
+        :param parameters: the parameters to render the sql query with
+        :type parameters: tuple or dict
+        """
+        if isinstance(sql, str):
+            sql = [sql]
+        with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
+            try:
+                with closing(conn.cursor()) as cur:
+                    for statement in sql:
+                        cur.execute(statement, parameters)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
 
+    def get_checksum(self, table, columns, where='1 = 1', parameters=None):
+        """
+        Returns (row count, checksum) of the rows of table matching where,
+        computed like MySqlHook.get_checksum.
+        :param columns: columns covered by the checksum
+        :type columns: list
+        :param where: filter of the rows, using quote_identifier
+        :type where: str
+        :rtype tuple
+        """
+        row = self.get_first(
+            "SELECT COUNT(*), COALESCE(SUM(('x' || SUBSTR(MD5(CONCAT_WS('#', {columns})), 1, 15))::bit(60)::bigint), 0) "
+            "FROM {table} WHERE {where}".format(
+                columns=', '.join(_quote_ident(col) for col in columns), table=table, where=where),
+            parameters)
+        return int(row[0]), int(row[1])
 
     def copy_expert(self, sql, filename, open=open):
         """
@@ -105,12 +278,277 @@ class PSqlHook(DbApiHook):
                 pass
 
         with open(filename, 'r+') as f:
-            with closing(self.get_conn()) as conn:
+            with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
                 with closing(conn.cursor()) as cur:
                     cur.copy_expert(sql, f)
                     f.truncate(f.tell())
                     conn.commit()
 
+    def copy_rows(self, table, batches, columns=None, schema=None, conn=None):
+        """
+        Streams row batches into table with COPY ... FROM STDIN.
+        Rows are serialized to COPY text format as psycopg2 reads them, so no
+        intermediate file is written and memory stays at about one batch.
+        NULL/NaN/NaT are sent as NULL and text is encoded by psycopg2 using
+        the connection client encoding.
+        :param table: target table
+        :type table: str
+        :param batches: iterable of DataFrames or sequences of row tuples
+        :type batches: iterable
+        :param columns: target columns in row order, all columns if None
+        :type columns: list
+        :param schema: schema of the target table
+        :type schema: str
+        :param conn: raw psycopg2 connection to run on. When given, the caller
+                     owns the transaction and nothing is committed here.
+        :type conn: connection object
+        :return: number of rows copied
+        :rtype int
+        """
+        target = _quote_ident(table)
+        if schema:
+            target = _quote_ident(schema) + "." + target
+        if columns:
+            target += " (" + ", ".join(_quote_ident(col) for col in columns) + ")"
+        sql = "COPY {target} FROM STDIN".format(target=target)
+        stream = TextRowStream(batches)
+
+        if conn is not None:
+            with closing(conn.cursor()) as cur:
+                cur.copy_expert(sql, stream, size=self.copy_buffer_size)
+            return stream.rows
+
+        with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
+            try:
+                with closing(conn.cursor()) as cur:
+                    cur.copy_expert(sql, stream, size=self.copy_buffer_size)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return stream.rows
+
+    def copy_record_batches(self, table, batches, schema=None):
+        """
+        Copies pyarrow RecordBatches into an existing table, one COPY per batch
+        in a single transaction. Batches whose columns are all fixed-width and
+        free of NULLs are sent in binary format, the others as CSV written by
+        arrow, and the rare batches with binary or interval columns through
+        the text format of copy_rows. Requires pyarrow.
+        :param table: target table
+        :type table: str
+        :param batches: iterable of RecordBatches named like the table columns
+        :type batches: iterable
+        :param schema: schema of the target table
+        :type schema: str
+        :return: number of rows copied
+        :rtype int
+        """
+        from google_analytics_plugin.hooks.arrow_format import csv_payload, pg_binary_payload, text_durations
+
+        pg_types = dict(self.get_column_types(table, schema))
+        target = _quote_ident(table)
+        if schema:
+            target = _quote_ident(schema) + "." + target
+        rows = 0
+        with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
+            try:
+                with closing(conn.cursor()) as cur:
+                    for batch in batches:
+                        if not batch.num_rows:
+                            continue
+                        columns = batch.schema.names
+                        column_list = " (" + ", ".join(_quote_ident(col) for col in columns) + ")"
+                        payload = pg_binary_payload(batch, [pg_types.get(col) for col in columns])
+                        if payload is not None:
+                            sql = "COPY " + target + column_list + " FROM STDIN WITH (FORMAT binary)"
+                        else:
+                            payload = csv_payload(batch)
+                            sql = "COPY " + target + column_list + " FROM STDIN WITH (FORMAT csv)"
+                        if payload is None:
+                            self.copy_rows(table, [text_durations(batch).to_pandas()], columns=columns,
+                                           schema=schema, conn=conn)
+                        else:
+                            cur.copy_expert(sql, io.BytesIO(payload), size=self.copy_buffer_size)
+                        rows += batch.num_rows
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return rows
+
+    def create_table_from_arrow(self, table, arrow_schema, if_exists='fail', schema=None, primary_key=None):
+        """
+        Creates table with the postgres types of the fields of arrow_schema
+        (see arrow_format.pg_type), honouring if_exists like pandas to_sql.
+        :param primary_key: columns of the primary key of a created table
+        :type primary_key: list
+        """
+        from google_analytics_plugin.hooks.arrow_format import pg_type
+
+        exists = self.has_table(table, schema)
+        if exists and if_exists == 'fail':
+            raise ValueError('Table {0} already exists.'.format(table))
+        if exists and if_exists == 'append':
+            return
+        target = _quote_ident(table)
+        if schema:
+            target = _quote_ident(schema) + "." + target
+        definitions = ["{0} {1}".format(_quote_ident(field.name), pg_type(field.type)) for field in arrow_schema]
+        if primary_key:
+            definitions.append("PRIMARY KEY ({0})".format(", ".join(_quote_ident(col) for col in primary_key)))
+        statements = ["DROP TABLE " + target] if exists else []
+        statements.append("CREATE TABLE {0} ({1})".format(target, ", ".join(definitions)))
+        self.run(statements)
+
+    def load_record_batches(self, batches, table, if_exists='append', schema=None, merge_keys=None):
+        """
+        Columnar counterpart of load_frames for pyarrow RecordBatches.
+        The table is created or replaced from the arrow schema of the first
+        batch, then all batches are written with copy_record_batches.
+        if_exists 'merge' goes through merge_frames, a missing table is then
+        created from the arrow schema with a primary key on merge_keys.
+        :return: number of rows written
+        :rtype int
+        """
+        from google_analytics_plugin.hooks.arrow_format import text_durations
+
+        batches = iter(batches)
+        first = next(batches, None)
+        if first is None:
+            return 0
+        if if_exists == 'merge':
+            if not merge_keys:
+                raise ValueError('merge_keys are required with if_exists="merge"')
+            if not self.has_table(table, schema):
+                self.create_table_from_arrow(table, first.schema, schema=schema, primary_key=merge_keys)
+            frames = (text_durations(batch).to_pandas() for batch in itertools.chain([first], batches))
+            return self.merge_frames(frames, table, merge_keys, schema=schema)
+
+        self.create_table_from_arrow(table, first.schema, if_exists=if_exists, schema=schema)
+        return self.copy_record_batches(table, itertools.chain([first], batches), schema=schema)
+
+    def merge_frames(self, frames, table, merge_keys, schema=None, dtype=None):
+        """
+        Upserts a stream of DataFrames into table. The rows are copied into a
+        temporary staging table and merged with a single
+        INSERT ... ON CONFLICT (merge_keys) DO UPDATE, all in one transaction.
+        A key repeated in the frames keeps its last row.
+        The table is created from the first frame with a primary key on
+        merge_keys if it does not exist yet, an existing table needs a unique
+        index on merge_keys (PostgreSQL 9.5+).
+        :param frames: iterable of DataFrames sharing the same columns
+        :type frames: iterable
+        :param table: target table
+        :type table: str
+        :param merge_keys: columns identifying a row
+        :type merge_keys: list
+        :param schema: schema of the target table
+        :type schema: str
+        :param dtype: to_sql dtype of the columns of a created table
+        :type dtype: dict
+        :return: number of rows merged
+        :rtype int
+        """
+        frames = iter(frames)
+        first = next(frames, None)
+        if first is None:
+            return 0
+        self.prepare_merge_target(first, table, merge_keys, schema=schema, dtype=dtype)
+
+        columns = list(first.columns)
+        target = _quote_ident(table)
+        if schema:
+            target = _quote_ident(schema) + "." + target
+        staging = ('_merge_' + table)[:63]
+        column_list = ", ".join(_quote_ident(col) for col in columns)
+        key_list = ", ".join(_quote_ident(col) for col in merge_keys)
+        updates = ", ".join("{0} = EXCLUDED.{0}".format(_quote_ident(col)) for col in columns if col not in merge_keys)
+        # ON CONFLICT cannot update a row twice: only the last staged row of a key is merged.
+        merge_sql = ("INSERT INTO {target} ({columns}) SELECT DISTINCT ON ({keys}) {columns} FROM {staging} "
+                     "ORDER BY {keys}, {seq} DESC ON CONFLICT ({keys}) ").format(
+            target=target, columns=column_list, staging=_quote_ident(staging), keys=key_list,
+            seq=_quote_ident(_MERGE_SEQUENCE))
+        merge_sql += ("DO UPDATE SET " + updates) if updates else "DO NOTHING"
+
+        with closing(self.get_sqlalchemy_engine().raw_connection()) as conn:
+            try:
+                with closing(conn.cursor()) as cur:
+                    cur.execute("CREATE TEMPORARY TABLE {staging} (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP".format(
+                        staging=_quote_ident(staging), target=target))
+                    cur.execute("ALTER TABLE {staging} ADD COLUMN {seq} bigserial".format(
+                        staging=_quote_ident(staging), seq=_quote_ident(_MERGE_SEQUENCE)))
+                rows = self.copy_rows(staging, itertools.chain([first], frames), columns=columns, conn=conn)
+                with closing(conn.cursor()) as cur:
+                    cur.execute(merge_sql)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return rows
+
+    def load_frames(self, frames, table, if_exists='append', load_method='insert', schema=None, merge_keys=None,
+                    dtype=None):
+        """
+        Writes a stream of DataFrames into table. Only the first frame applies
+        if_exists, the following ones are appended.
+        if_exists 'merge' upserts the rows on merge_keys with merge_frames,
+        whatever the load_method.
+        load_method 'insert' writes every frame with pandas to_sql.
+        load_method 'batched' does the same with multi-row INSERTs bounded by
+        insert_batch_rows and insert_batch_bytes.
+        load_method 'copy' creates or replaces the table from the first frame's
+        columns with to_sql and streams all rows through a single COPY.
+        load_method 'arrow' expects pyarrow RecordBatches instead of frames,
+        see load_record_batches.
+        :param frames: iterable of DataFrames sharing the same columns
+        :type frames: iterable
+        :param table: target table
+        :type table: str
+        :param if_exists: pandas to_sql if_exists for the first frame
+        :type if_exists: str
+        :param load_method: one of PSqlHook.load_methods
+        :type load_method: str
+        :param schema: schema of the target table
+        :type schema: str
+        :param merge_keys: key columns for if_exists 'merge'
+        :type merge_keys: list
+        :param dtype: to_sql dtype of the columns of a created table, so that
+                      they do not depend on the values of the first frame
+        :type dtype: dict
+        :return: number of rows written
+        :rtype int
+        """
+        if load_method not in self.load_methods:
+            raise ValueError('Unknown load_method {0}, expected one of {1}'.format(load_method, self.load_methods))
+        if load_method == 'arrow':
+            return self.load_record_batches(frames, table, if_exists=if_exists, schema=schema, merge_keys=merge_keys)
+        if if_exists == 'merge':
+            if not merge_keys:
+                raise ValueError('merge_keys are required with if_exists="merge"')
+            return self.merge_frames(frames, table, merge_keys, schema=schema, dtype=dtype)
+
+        engine = self.get_sqlalchemy_engine()
+        frames = iter(frames)
+        first = next(frames, None)
+        if first is None:
+            return 0
+
+        if load_method == 'copy':
+            first.head(0).to_sql(table, engine, schema=schema, if_exists=if_exists, index=False, dtype=dtype)
+            return self.copy_rows(table, itertools.chain([first], frames),
+                                  columns=list(first.columns), schema=schema)
+
+        method = None
+        if load_method == 'batched':
+            method = BatchedInsert(self.insert_batch_rows, self.insert_batch_bytes)
+        rows = 0
+        for df_ in itertools.chain([first], frames):
+            df_.to_sql(table, engine, schema=schema, if_exists=if_exists, index=False, method=method, dtype=dtype)
+            if_exists = 'append'
+            rows += len(df_)
+        return rows
+
     def bulk_load(self, table, tmp_file):
         """
         Loads a tab-delimited file into a database table
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# On-disk cache of query results shared by MySqlHook and PSqlHook reads.
+# Entries are keyed by (conn_id, database, normalized sql, parameters) and
+# stored one file per entry: a JSON header line (expiry, tables read) followed
+# by the zlib-compressed pickle of the result. Files are written atomically,
+# so concurrent tasks on the same worker never read a partial entry.
+# The directory is capped in size, least recently used entries are evicted
+# first. Location and cap can be set through the environment:
+#     AIRFLOW_RESULT_CACHE_DIR, AIRFLOW_RESULT_CACHE_MAX_BYTES
+# Entries are unpickled, so the directory must be private to the worker user:
+# it is created with mode 0700 and refused when owned by another user or
+# writable by group or others.
+#
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import stat
+import tempfile
+import threading
+import time
+import zlib
+
+from airflow import configuration as conf
+
+
+DEFAULT_CACHE_DIR = os.path.join(conf.get('core', 'airflow_home'), 'cache', 'results')
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+_TABLE_PATTERN = re.compile(r'\b(?:from|join)\s+([`"\w.]+)', re.IGNORECASE)
+_caches = {}
+_lock = threading.Lock()
+
+
+def normalize_sql(sql):
+    """
+    Collapses whitespace and drops a trailing semicolon so that formatting
+    differences do not produce distinct cache entries.
+    """
+    return ' '.join(sql.split()).rstrip(';').strip()
+
+
+def check_private(directory):
+    """
+    Raises unless directory is a real directory owned by the current user and
+    not writable by group or others.
+    """
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise ValueError('Result cache {0} is not a directory'.format(directory))
+    if info.st_uid != os.getuid():
+        raise ValueError('Result cache {0} is not owned by the current user'.format(directory))
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise ValueError('Result cache {0} is writable by other users'.format(directory))
+
+
+def _table_name(name):
+    return name.replace('`', '').replace('"', '').split('.')[-1].lower()
+
+
+def referenced_tables(sql):
+    """
+    Returns the lower-cased names of the tables sql reads FROM or JOINs,
+    without their schema prefix.
+    """
+    return sorted(set(_table_name(name) for name in _TABLE_PATTERN.findall(sql)))
+
+
+class ResultCache(object):
+    """
+    TTL + LRU result cache in a local directory.
+    :param directory: directory holding the entries
+    :type directory: string
+    :param max_bytes: size cap of the directory
+    :type max_bytes: int
+    """
+
+    suffix = '.result'
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_private(directory)
+
+    def key(self, conn_id, database, sql, parameters=None):
+        """
+        Returns the entry key of a query.
+        """
+        payload = json.dumps([conn_id, database, normalize_sql(sql), parameters], default=repr, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _entries(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                yield os.path.join(self.directory, name)
+
+    @staticmethod
+    def _read_header(handle):
+        return json.loads(handle.readline().decode('utf-8'))
+
+    def get(self, key):
+        """
+        Returns (True, value) for a live entry, (False, None) otherwise.
+        Expired entries are removed.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as handle:
+                expired = self._read_header(handle)['expires'] < time.time()
+                if not expired:
+                    value = pickle.loads(zlib.decompress(handle.read()))
+        except (IOError, OSError, ValueError, zlib.error, pickle.UnpicklingError):
+            return False, None
+        if expired:
+            self._remove(path)
+            return False, None
+        # The modification time doubles as the LRU clock.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return True, value
+
+    def set(self, key, value, ttl, tables=()):
+        """
+        Stores value for ttl seconds, then evicts entries past the size cap.
+        :param tables: tables the value was read from, for invalidate()
+        """
+        header = json.dumps({'expires': time.time() + ttl, 'tables': list(tables)}).encode('utf-8')
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(header + b'\n')
+                handle.write(data)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Removes expired entries, then the least recently used ones until the
+        directory fits in max_bytes.
+        """
+        now = time.time()
+        entries = []
+        for path in self._entries():
+            try:
+                with open(path, 'rb') as handle:
+                    expires = self._read_header(handle)['expires']
+                stat = os.stat(path)
+            except (IOError, OSError, ValueError):
+                continue
+            if expires < now:
+                self._remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def invalidate(self, tables):
+        """
+        Removes every entry read from one of tables and returns their count.
+        :param tables: table name or list of table names
+        """
+        if isinstance(tables, str):
+            tables = [tables]
+        targets = set(_table_name(table) for table in tables)
+        removed = 0
+        for path in self._entries():
+            try:
+                with open(path, 'rb') as handle:
+                    entry_tables = self._read_header(handle)['tables']
+            except (IOError, OSError, ValueError):
+                continue
+            if targets.intersection(entry_tables):
+                self._remove(path)
+                removed += 1
+        return removed
+
+    def clear(self):
+        for path in self._entries():
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_cache():
+    """
+    Returns the process-wide cache configured from the environment.
+    """
+    directory = os.environ.get('AIRFLOW_RESULT_CACHE_DIR', DEFAULT_CACHE_DIR)
+    max_bytes = int(os.environ.get('AIRFLOW_RESULT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+    with _lock:
+        cache = _caches.get((directory, max_bytes))
+        if cache is None:
+            cache = ResultCache(directory, max_bytes)
+            _caches[(directory, max_bytes)] = cache
+        return cache
+
+
+def cached_query(conn_id, database, sql, parameters, ttl, compute):
+    """
+    Returns the cached result of a query, running compute() and caching its
+    result for ttl seconds on a miss. A falsy ttl bypasses the cache.
+    """
+    if not ttl:
+        return compute()
+    cache = get_cache()
+    key = cache.key(conn_id, database, sql, parameters)
+    found, value = cache.get(key)
+    if found:
+        return value
+    value = compute()
+    cache.set(key, value, ttl, referenced_tables(sql))
+    return value
+
+
+def invalidate_tables(tables):
+    """
+    Drops the cached results read from tables, e.g. after loading them.
+    """
+    return get_cache().invalidate(tables)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Serializes row batches into the tab-delimited text format understood by both
+# PostgreSQL "COPY ... FROM STDIN" and MySQL "LOAD DATA INFILE" defaults:
+# fields separated by tabs, rows by newlines, NULL written as \N and
+# backslash, tab, newline, carriage return and NUL escaped with a backslash.
+#
+
+import numpy as np
+from pandas import DataFrame, Timedelta, isna
+
+
+NULL = '\\N'
+
+_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '\t': '\\t',
+    '\n': '\\n',
+    '\r': '\\r',
+    '\x00': '\\0',
+})
+
+
+def escape_text(value):
+    """
+    Escapes the field and row separators inside a string value.
+    """
+    return value.translate(_ESCAPES)
+
+
+def bytea_hex(value):
+    """
+    Formats bytes as a postgres bytea hex literal, escaped for COPY text format.
+    """
+    return '\\\\x' + value.hex()
+
+
+def format_value(value, true='t', false='f', bytes_format=bytea_hex):
+    """
+    Formats a single cell.
+    Integral floats are written without a fraction, since pandas turns
+    integer columns holding NULLs into float64. Timedeltas are written as
+    nanoseconds, the BIGINT that to_sql creates for them.
+    :param value: cell value, NaN/NaT/None are written as NULL
+    :param true: token written for True
+    :param false: token written for False
+    :param bytes_format: callable formatting bytes values
+    :return: escaped field
+    :rtype str
+    """
+    if value is None:
+        return NULL
+    if isinstance(value, str):
+        return value.translate(_ESCAPES)
+    if isinstance(value, bool):
+        return true if value else false
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes_format(bytes(value))
+    if isna(value):
+        return NULL
+    if isinstance(value, (float, np.floating)) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, Timedelta):
+        return str(value.value)
+    return str(value).translate(_ESCAPES)
+
+
+def iter_rows(batch):
+    """
+    Iterates the rows of a batch, either a DataFrame or a sequence of tuples.
+    """
+    if isinstance(batch, DataFrame):
+        return batch.itertuples(index=False, name=None)
+    return batch
+
+
+def format_rows(rows, **format_kwargs):
+    """
+    Formats an iterable of rows into one block of text lines.
+    """
+    return ''.join(
+        '\t'.join([format_value(value, **format_kwargs) for value in row]) + '\n'
+        for row in rows
+    )
+
+
+class TextRowStream(object):
+    """
+    Read-only file-like object over row batches, serialized lazily as the
+    consumer reads. Suitable as the file argument of psycopg2 copy_expert,
+    so rows go straight into the COPY stream without a temporary file.
+    :param batches: iterable of DataFrames or sequences of row tuples
+    :type batches: iterable
+    """
+
+    def __init__(self, batches, **format_kwargs):
+        self._batches = iter(batches)
+        self._format_kwargs = format_kwargs
+        self._buffer = ''
+        self._pos = 0
+        self.rows = 0
+
+    def _next_block(self):
+        for batch in self._batches:
+            rows = list(iter_rows(batch))
+            if rows:
+                self.rows += len(rows)
+                return format_rows(rows, **self._format_kwargs)
+        return None
+
+    def read(self, size=-1):
+        available = len(self._buffer) - self._pos
+        while size < 0 or available < size:
+            block = self._next_block()
+            if block is None:
+                break
+            self._buffer = self._buffer[self._pos:] + block
+            self._pos = 0
+            available = len(self._buffer)
+        if size < 0:
+            size = available
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
@@ -1,18 +1,84 @@
 #Returns a pandas dataframe with required query results.
+#With spill_dir the result is written to an Arrow IPC (Feather v2) file instead
+#and only a small reference is returned, so XCom does not carry the data.
+#read_query_result opens such a reference in a downstream task.
 
 from airflow.models import BaseOperator
+import os
 import pandas as pd
 from datetime import datetime
 from airflow.plugins_manager import AirflowPlugin
 from google_analytics_plugin.hooks.mysql_hook import MySqlHook
+from google_analytics_plugin.hooks.frame_compaction import compact_frame
+from google_analytics_plugin.operators.profiling import profiled
+from google_analytics_plugin.operators.task_metrics import TaskMetrics, chunk_size
+
+
+def open_query_result(reference):
+    """
+    Memory-maps the file of a spilled result and returns it as a pyarrow Table.
+    Uncompressed columns are not copied, they are paged in when accessed.
+    :param reference: value returned by MySqlQueryOperator with spill_dir, or a path
+    :type reference: dict/string
+    :rtype pyarrow.Table
+    """
+    import pyarrow as pa
+
+    path = reference['path'] if isinstance(reference, dict) else reference
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def read_query_result(reference, columns=None):
+    """
+    Reads a spilled result into a DataFrame, only materializing columns.
+    :param reference: value returned by MySqlQueryOperator with spill_dir, or a path
+    :type reference: dict/string
+    :param columns: columns to read, all of them by default
+    :type columns: list
+    :rtype pandas.DataFrame
+    """
+    table = open_query_result(reference)
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas()
 
 
 class MySqlQueryOperator(BaseOperator):
+    """
+        MySql Query Operator
+        :param mysql_conn_id:           Source mysql connection id.
+        :type mysql_conn_id:            string
+        :param database:                Source mysql database.
+        :type database:                 string
+        :param query:                   Query to run.
+        :type query:                    string
+        :param spill_dir:               Local or shared directory to write the result to as an
+                                        Arrow IPC file. The operator then returns
+                                        {'path', 'rows', 'columns'} instead of the DataFrame.
+                                        Requires pyarrow.
+        :type spill_dir:                string
+        :param spill_compression:       None, 'lz4' or 'zstd'. Compressed files are smaller but
+                                        are decompressed on read instead of memory-mapped.
+        :type spill_compression:        string
+        :param chunk_rows:              Rows fetched per chunk when spilling.
+        :type chunk_rows:               int
+        :param cache_ttl:               Serve the DataFrame from the on-disk result cache for this
+                                        many seconds. Not used when spilling.
+        :type cache_ttl:                int
+        :param compact:                 Return the DataFrame with categorical strings, downcast
+                                        numerics and datetime64 dates. Not used when spilling.
+        :type compact:                  bool
+        """
 
     def __init__(self,
                  mysql_conn_id,
                  database,
                  query,
+                 spill_dir=None,
+                 spill_compression=None,
+                 chunk_rows=100000,
+                 cache_ttl=None,
+                 compact=False,
                  *args,
                  **kwargs):
                 super().__init__(*args, **kwargs)
@@ -20,16 +86,58 @@ class MySqlQueryOperator(BaseOperator):
                 self.mysql_conn_id = mysql_conn_id
                 self.database = database
                 self.query = query
+                self.spill_dir = spill_dir
+                self.spill_compression = spill_compression
+                self.chunk_rows = chunk_rows
+                self.cache_ttl = cache_ttl
+                self.compact = compact
 
-    def execute(self, context):
+    def spill(self, mysql_hook, path, metrics):
+        import pyarrow as pa
 
-        mysql_hook = MySqlHook(mysql_conn_id=self.mysql_conn_id, schema=self.database)
-        conn = mysql_hook.get_conn()
+        options = pa.ipc.IpcWriteOptions(compression=self.spill_compression)
+        rows = 0
+        writer = None
+        # Written under a temporary name so readers never see a partial file.
+        tmp_path = path + '.tmp'
         try:
-            df_ = pd.read_sql(query, conn)
-        except Exception as e:
-            print("Error {0}".format(str(e)))
-        return df_
+            with pa.OSFile(tmp_path, 'wb') as sink:
+                for batch in metrics.track(mysql_hook.iter_record_batches(self.query, self.chunk_rows)):
+                    with metrics.phase('load'):
+                        if writer is None:
+                            writer = pa.ipc.new_file(sink, batch.schema, options=options)
+                            columns = batch.schema.names
+                        if batch.num_rows:
+                            writer.write_batch(batch)
+                            rows += batch.num_rows
+                writer.close()
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return {'path': path, 'rows': rows, 'columns': columns}
 
+    @profiled
+    def execute(self, context):
 
+        metrics = TaskMetrics(self)
+        mysql_hook = MySqlHook(mysql_conn_id=self.mysql_conn_id, schema=self.database)
+        metrics.connect(mysql_hook)
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = os.path.join(self.spill_dir, '{0}.{1}.{2}.arrow'.format(
+                self.dag_id, self.task_id, context['ts_nodash']))
+            reference = self.spill(mysql_hook, path, metrics)
+            self.log.info('Spilled %s rows to %s', reference['rows'], path)
+            metrics.report(context)
+            return reference
 
+        with metrics.phase('extract'):
+            df_ = mysql_hook.get_pandas_df(self.query, cache_ttl=self.cache_ttl)
+        metrics.add(*chunk_size(df_))
+        if self.compact:
+            with metrics.phase('transform'):
+                df_ = compact_frame(df_, log=self.log)
+        metrics.report(context)
+        return df_
@@ -0,0 +1,84 @@
+#Outputs sql-query results to a parquet file.
+#Streams the result from a server-side cursor, one row group per chunk, with
+#column types taken from the MySQL cursor description.
+
+from airflow.models import BaseOperator
+from airflow.plugins_manager import AirflowPlugin
+from google_analytics_plugin.hooks.mysql_hook import MySqlHook
+from google_analytics_plugin.operators.profiling import profiled
+from google_analytics_plugin.operators.task_metrics import TaskMetrics
+
+
+class MySqlToParquetOperator(BaseOperator):
+    """
+        MySql To Parquet Operator
+        Requires pyarrow.
+        :param mysql_conn_id:           Source mysql connection id.
+        :type mysql_conn_id:            string
+        :param database:                Source mysql database.
+        :type database:                 string
+        :param query:                   Query whose result is exported.
+        :type query:                    string
+        :param filename:                Output file.
+        :type filename:                 string
+        :param chunk_rows:              Rows fetched per chunk, each chunk is written as one row group.
+        :type chunk_rows:               int
+        :param compression:             'snappy', 'zstd' or None.
+        :type compression:              string
+        :param use_dictionary:          Dictionary encode columns, True for all of them or a list
+                                        of column names.
+        :type use_dictionary:           bool/list
+        :return:                        The number of rows written.
+        """
+
+    compressions = ('snappy', 'zstd')
+
+    def __init__(self,
+                 mysql_conn_id,
+                 database,
+                 query,
+                 filename,
+                 chunk_rows=100000,
+                 compression='snappy',
+                 use_dictionary=True,
+                 *args,
+                 **kwargs):
+                super().__init__(*args, **kwargs)
+
+                self.mysql_conn_id = mysql_conn_id
+                self.database = database
+                self.query = query
+                self.filename = filename
+                self.chunk_rows = chunk_rows
+                self.compression = compression
+                self.use_dictionary = use_dictionary
+
+                if compression is not None and compression not in self.compressions:
+                    raise Exception('Please specify compression as one of {0}.'.format(list(self.compressions)))
+
+    @profiled
+    def execute(self, context):
+        import pyarrow.parquet as pq
+
+        metrics = TaskMetrics(self)
+        mysql_hook = MySqlHook(mysql_conn_id=self.mysql_conn_id, schema=self.database)
+        metrics.connect(mysql_hook)
+        rows = 0
+        writer = None
+        try:
+            for batch in metrics.track(mysql_hook.iter_record_batches(self.query, self.chunk_rows)):
+                with metrics.phase('load'):
+                    if writer is None:
+                        writer = pq.ParquetWriter(self.filename, batch.schema,
+                                                  compression=self.compression or 'none',
+                                                  use_dictionary=self.use_dictionary)
+                    if batch.num_rows:
+                        writer.write_batch(batch, row_group_size=batch.num_rows)
+                        rows += batch.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+
+        self.log.info('Exported %s rows to %s', rows, self.filename)
+        metrics.report(context)
+        return rows
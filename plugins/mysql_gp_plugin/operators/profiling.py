@@ -0,0 +1,219 @@
+# Opt-in profiling of operator execute() methods.
+# Enabled per task with params={'profile': 'cpu'} or for every task using a
+# connection with the extra {"profile": "cpu"}. Connection extras are only
+# read for the connections listed in AIRFLOW_PROFILE_CONN_IDS (comma
+# separated), so tasks pay no metadata lookup otherwise. Modes, comma separated:
+#     cpu       statistical sampler over every thread of the task, keeping its
+#               own cost within profile_overhead (fraction of the run time)
+#     cprofile  deterministic cProfile of the thread running execute()
+#     memory    tracemalloc, top allocation sites by size
+# Artifacts are written next to the task log as <try_number>.<mode>.txt
+# (plus a .pstats file for cprofile and a .folded stack file for cpu).
+
+import cProfile
+import collections
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+from airflow import configuration as conf
+from airflow.hooks.base_hook import BaseHook
+
+DEFAULT_OVERHEAD = 0.02
+MIN_INTERVAL = 0.001
+MAX_DEPTH = 64
+TOP = 40
+
+
+def profiled_conn_ids():
+    """
+    Returns the connection ids opted in to profiling by AIRFLOW_PROFILE_CONN_IDS.
+    """
+    return set(conn_id.strip() for conn_id in os.environ.get('AIRFLOW_PROFILE_CONN_IDS', '').split(',')
+               if conn_id.strip())
+
+
+def _connection_extras(operator):
+    conn_ids = profiled_conn_ids()
+    if not conn_ids:
+        return
+    for name, value in vars(operator).items():
+        if name.endswith('conn_id') or '_conn_id_' in name:
+            if value in conn_ids:
+                yield BaseHook.get_connection(value).extra_dejson
+
+
+def _settings(source):
+    modes = source.get('profile')
+    if not modes:
+        return None
+    if modes is True:
+        modes = 'cpu'
+    return (set(mode.strip() for mode in str(modes).split(',')),
+            float(source.get('profile_overhead', DEFAULT_OVERHEAD)))
+
+
+def profile_settings(operator):
+    """
+    Returns (modes, overhead budget) requested for operator by its params,
+    else by the extras of one of its opted-in connections.
+    """
+    settings = _settings(operator.params or {})
+    if settings:
+        return settings
+    for extras in _connection_extras(operator):
+        settings = _settings(extras)
+        if settings:
+            return settings
+    return set(), DEFAULT_OVERHEAD
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stacks of every other thread of the process. After each
+    sample the interval is stretched so that sampling time stays below
+    overhead of the elapsed time.
+    """
+
+    def __init__(self, overhead):
+        super(StackSampler, self).__init__(name='profile-sampler', daemon=True)
+        self.overhead = overhead
+        self.interval = MIN_INTERVAL
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.cost = 0.0
+        self.stopped = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            start = time.perf_counter()
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append('{0}:{1}:{2}'.format(os.path.basename(code.co_filename),
+                                                     code.co_name, frame.f_lineno))
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+            cost = time.perf_counter() - start
+            self.cost += cost
+            self.interval = max(MIN_INTERVAL, cost / self.overhead)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def report(self, elapsed):
+        own = collections.Counter()
+        cumulative = collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for frame in set(stack):
+                cumulative[frame] += count
+        total = float(sum(self.stacks.values())) or 1.0
+        lines = ['{0} samples in {1:.1f}s, sampling cost {2:.3f}s ({3:.2%})'.format(
+            self.samples, elapsed, self.cost, self.cost / elapsed if elapsed else 0), '',
+            'own %      cum %      frame']
+        for frame, count in own.most_common(TOP):
+            lines.append('{0:6.2f}  {1:8.2f}    {2}'.format(100 * count / total, 100 * cumulative[frame] / total, frame))
+        lines += ['', 'cum %      frame']
+        for frame, count in cumulative.most_common(TOP):
+            lines.append('{0:6.2f}    {1}'.format(100 * count / total, frame))
+        return '\n'.join(lines) + '\n'
+
+    def folded(self):
+        # Collapsed stacks, the input format of flamegraph.pl and speedscope.
+        return ''.join('{0} {1}\n'.format(';'.join(stack), count) for stack, count in self.stacks.items())
+
+
+class ExecuteProfiler(object):
+    """
+    Runs the requested profilers around one execute() call and writes their
+    artifacts next to the task log.
+    """
+
+    def __init__(self, operator, context, modes, overhead):
+        self.operator = operator
+        self.context = context
+        self.modes = modes
+        self.overhead = overhead
+        self.sampler = None
+        self.profile = None
+        self.traced = False
+
+    def artifact_path(self, suffix):
+        ti = self.context.get('ti')
+        directory = os.path.join(os.path.expanduser(conf.get('core', 'base_log_folder')),
+                                 self.operator.dag_id, self.operator.task_id, self.context.get('ts', 'adhoc'))
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, '{0}.{1}'.format(getattr(ti, 'try_number', 0), suffix))
+
+    def write(self, suffix, text):
+        path = self.artifact_path(suffix)
+        with open(path, 'w') as handle:
+            handle.write(text)
+        self.operator.log.info('Profile written to %s', path)
+        return path
+
+    def __enter__(self):
+        self.start = time.time()
+        if 'memory' in self.modes and not tracemalloc.is_tracing():
+            # Tracing started by someone else is left running on exit.
+            tracemalloc.start()
+            self.traced = True
+        if 'cpu' in self.modes:
+            self.sampler = StackSampler(self.overhead)
+            self.sampler.start()
+        if 'cprofile' in self.modes:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        # Artifacts are written whether execute() failed or not, a failing
+        # run is often the one worth looking at.
+        elapsed = time.time() - self.start
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.artifact_path('cprofile.pstats'))
+            out = io.StringIO()
+            pstats.Stats(self.profile, stream=out).sort_stats('cumulative').print_stats(TOP)
+            self.write('cprofile.txt', out.getvalue())
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.write('cpu.txt', self.sampler.report(elapsed))
+            self.write('cpu.folded', self.sampler.folded())
+        if 'memory' in self.modes and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if self.traced:
+                tracemalloc.stop()
+            lines = ['traced memory: current {0:.1f} MiB, peak {1:.1f} MiB'.format(
+                current / 1048576.0, peak / 1048576.0), '']
+            lines += [str(stat) for stat in snapshot.statistics('lineno')[:TOP]]
+            self.write('memory.txt', '\n'.join(lines) + '\n')
+        return False
+
+
+def profiled(execute):
+    """
+    Decorates an operator execute() method to run it under the profilers
+    requested by profile_settings, or unchanged when none is.
+    """
+    @functools.wraps(execute)
+    def wrapper(self, context):
+        modes, overhead = profile_settings(self)
+        if not modes:
+            return execute(self, context)
+        with ExecuteProfiler(self, context, modes, overhead):
+            return execute(self, context)
+    return wrapper
@@ -0,0 +1,160 @@
+# Per-task instrumentation shared by the operators of the plugins.
+# Records the time spent in the connect, extract, transform and load phases,
+# the rows and bytes moved and the peak memory of the task, and reports them
+# to the task log, to XCom (key 'metrics') and to statsd as
+#     plugins.<dag_id>.<task_id>.<phase>   timers in ms
+#     plugins.<dag_id>.<task_id>.rows      counter
+#     plugins.<dag_id>.<task_id>.bytes     counter
+#     plugins.<dag_id>.<task_id>.peak_rss  gauge in MiB
+
+import resource
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from airflow.stats import Stats
+
+
+def chunk_size(chunk):
+    """
+    Returns (rows, bytes) of a DataFrame, pyarrow RecordBatch, mapping of
+    column name to values or sequence of rows. DataFrame bytes are the shallow
+    memory usage, which counts object columns by their pointers only, since
+    walking every string of every chunk costs as much as the transfer itself.
+    Columns and row sequences are counted as rows only.
+    """
+    if hasattr(chunk, 'nbytes') and hasattr(chunk, 'num_rows'):
+        return chunk.num_rows, chunk.nbytes
+    if hasattr(chunk, 'memory_usage'):
+        return len(chunk), int(chunk.memory_usage(index=False, deep=False).sum())
+    if isinstance(chunk, dict):
+        return len(next(iter(chunk.values()), ())), 0
+    return len(chunk), 0
+
+
+class TaskMetrics(object):
+    """
+    Collects the phase durations and volumes of one task execution.
+    Phases may run concurrently in several threads, their durations then
+    add up the time of every thread and can exceed the total.
+    :param operator: operator being executed, its log and ids are used
+    """
+
+    phases = ('connect', 'extract', 'transform', 'load')
+
+    def __init__(self, operator):
+        self.operator = operator
+        self.durations = OrderedDict((name, 0.0) for name in self.phases)
+        self.rows = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def add(self, rows=0, bytes=0):
+        with self.lock:
+            self.rows += rows
+            self.bytes += bytes
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def connect(self, *hooks):
+        """
+        Checks a connection out of the pool of every sql hook, which opens
+        it on first use, and times it as the connect phase.
+        """
+        with self.phase('connect'):
+            for hook in hooks:
+                hook.get_conn().close()
+
+    def track(self, chunks, name='extract'):
+        """
+        Wraps an iterable of chunks, timing the production of every chunk as
+        phase name and counting its rows and bytes.
+        """
+        iterator = iter(chunks)
+        try:
+            while True:
+                start = time.time()
+                try:
+                    chunk = next(iterator)
+                finally:
+                    self.add_time(name, time.time() - start)
+                self.add(*chunk_size(chunk))
+                yield chunk
+        except StopIteration:
+            return
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    @contextmanager
+    def consuming(self, chunks, name='load'):
+        """
+        Yields chunks wrapped so that the block is timed as phase name minus
+        the time spent waiting for the next chunk, which belongs to the
+        producer (e.g. the extraction).
+        """
+        waits = [0.0]
+
+        def wrapped():
+            iterator = iter(chunks)
+            while True:
+                start = time.time()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    waits[0] += time.time() - start
+                yield chunk
+
+        start = time.time()
+        try:
+            yield wrapped()
+        finally:
+            self.add_time(name, time.time() - start - waits[0])
+
+    def summary(self):
+        return {
+            'phases': dict((name, round(seconds, 3)) for name, seconds in self.durations.items()),
+            'total': round(time.time() - self.start, 3),
+            'rows': self.rows,
+            'bytes': self.bytes,
+            # ru_maxrss is in KiB on Linux.
+            'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        }
+
+    def report(self, context=None):
+        """
+        Logs the summary, pushes it to XCom and emits it to statsd.
+        """
+        summary = self.summary()
+        self.operator.log.info('Task metrics: %s, total %.1fs, %s rows, %.1f MiB, peak RSS %.1f MiB',
+                               ', '.join('{0} {1:.1f}s'.format(name, seconds)
+                                         for name, seconds in summary['phases'].items()),
+                               summary['total'], summary['rows'], summary['bytes'] / 1048576.0,
+                               summary['peak_rss_mib'])
+        ti = (context or {}).get('ti')
+        if ti is not None:
+            ti.xcom_push(key='metrics', value=summary)
+
+        prefix = 'plugins.{0}.{1}'.format(self.operator.dag_id, self.operator.task_id)
+        for name, seconds in summary['phases'].items():
+            Stats.timing('{0}.{1}'.format(prefix, name), seconds * 1000)
+        Stats.incr(prefix + '.rows', summary['rows'])
+        Stats.incr(prefix + '.bytes', summary['bytes'])
+        Stats.gauge(prefix + '.peak_rss', summary['peak_rss_mib'])
+        return summary
+
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The plugins are imported the way Airflow loads them, from the plugins folder.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plugins'))
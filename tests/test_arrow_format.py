@@ -0,0 +1,23 @@
+import pyarrow as pa
+from MySQLdb.constants import FIELD_TYPE, FLAG
+
+from google_analytics_plugin.hooks.arrow_format import pg_type, rows_to_record_batch, schema_from_description
+
+
+def column(name, type_code):
+    return (name, type_code, None, None, None, None, True)
+
+
+def test_unsigned_bigint_is_uint64():
+    description = [column('id', FIELD_TYPE.LONGLONG), column('total', FIELD_TYPE.LONGLONG),
+                   column('small', FIELD_TYPE.LONG)]
+    schema = schema_from_description(description, flags=[FLAG.UNSIGNED | FLAG.NOT_NULL, 0, FLAG.UNSIGNED])
+    assert schema.types == [pa.uint64(), pa.int64(), pa.int64()]
+    assert pg_type(schema.field('id').type) == 'numeric(20)'
+
+    batch = rows_to_record_batch([(2 ** 64 - 1, -1, 2 ** 32 - 1)], schema)
+    assert batch.column(0).to_pylist() == [2 ** 64 - 1]
+
+
+def test_bigint_without_flags_is_int64():
+    assert schema_from_description([column('id', FIELD_TYPE.LONGLONG)]).types == [pa.int64()]
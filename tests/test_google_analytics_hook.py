@@ -0,0 +1,213 @@
+import types
+
+import httplib2
+import pytest
+from apiclient.errors import HttpError
+
+from google_analytics_plugin.hooks import google_analytics_hook as ga
+from google_analytics_plugin.hooks.google_analytics_hook import (GoogleAnalyticsHook, TokenBucket, date_slices,
+                                                                 is_retryable, merge_reports, pack_batches)
+
+
+class FakeRequest(object):
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+class FakeReports(object):
+    """reports() of a Reporting API v4 service: every report has rows_per_report rows of its view and date."""
+
+    def __init__(self, rows_per_report):
+        self.rows_per_report = rows_per_report
+        self.bodies = []
+
+    def report(self, request):
+        start = int(request.get('pageToken') or 0)
+        end = min(start + request['pageSize'], self.rows_per_report)
+        report = {
+            'columnHeader': {
+                'dimensions': ['ga:date'],
+                'metricHeader': {'metricHeaderEntries': [{'name': 'ga:sessions', 'type': 'INTEGER'}]},
+            },
+            'data': {'rows': [{'dimensions': [request['dateRanges'][0]['startDate']],
+                               'metrics': [{'values': ['{0}-{1}'.format(request['viewId'], row)]}]}
+                              for row in range(start, end)]},
+        }
+        if end < self.rows_per_report:
+            report['nextPageToken'] = str(end)
+        return report
+
+    def batchGet(self, body):
+        self.bodies.append(body)
+        return FakeRequest({'reports': [self.report(request) for request in body['reportRequests']]})
+
+
+class FakeClock(object):
+    """time module whose sleep advances monotonic instead of waiting."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FailingRequest(object):
+    def __init__(self, errors, response=None):
+        self.errors = list(errors)
+        self.response = response
+        self.calls = 0
+
+    def execute(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.response
+
+
+def http_error(status, content=b'{}'):
+    return HttpError(httplib2.Response({'status': status}), content)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(ga, 'time', fake)
+    monkeypatch.setattr(ga.random, 'random', lambda: 0.5)
+    return fake
+
+
+@pytest.fixture
+def ga_hook(monkeypatch):
+    monkeypatch.setattr(ga, '_buckets', {})
+    monkeypatch.setattr(GoogleAnalyticsHook, 'get_connection',
+                        classmethod(lambda cls, conn_id: types.SimpleNamespace(password='token', extra_dejson={})))
+    hook = GoogleAnalyticsHook('test_ga')
+    hook.reports = FakeReports(rows_per_report=3)
+    hook.get_service_object = lambda name: types.SimpleNamespace(reports=lambda: hook.reports)
+    return hook
+
+
+def report_args(**kwargs):
+    args = dict(since='2020-01-01', until='2020-01-01', sampling_level=None, dimensions=[{'name': 'ga:date'}],
+                metrics=[{'expression': 'ga:sessions'}], page_size=2, include_empty_rows=False,
+                dimension_filter_clauses=None)
+    args.update(kwargs)
+    return args
+
+
+def test_date_slices():
+    assert date_slices('2020-01-01', '2020-01-09') == [('2020-01-01', '2020-01-09')]
+    assert date_slices('2020-01-30', '2020-02-01', 'day') == [
+        ('2020-01-30', '2020-01-30'), ('2020-01-31', '2020-01-31'), ('2020-02-01', '2020-02-01')]
+    assert date_slices('2020-01-01', '2020-01-09', 'week') == [
+        ('2020-01-01', '2020-01-07'), ('2020-01-08', '2020-01-09')]
+    assert date_slices('2020-01-02', '2020-01-01', 'day') == []
+    with pytest.raises(ValueError):
+        date_slices('2020-01-01', '2020-01-09', 'month')
+    with pytest.raises(ValueError):
+        date_slices('yesterday', '2020-01-09', 'day')
+
+
+def test_pack_batches_groups_compatible_requests_by_five():
+    def request(view, start):
+        return {'viewId': view, 'dateRanges': [{'startDate': start, 'endDate': start}], 'pageSize': 10}
+
+    requests = [request('1', '2020-01-01')] * 7 + [request('2', '2020-01-01'), request('1', '2020-01-02')]
+    # The 7th request of view 1 waits for the next batch of its group.
+    requests.insert(3, request('2', '2020-01-01'))
+    assert pack_batches(requests) == [[0, 1, 2, 4, 5], [6, 7], [3, 8], [9]]
+    assert pack_batches([]) == []
+
+
+def test_merge_reports_keeps_the_first_header_and_every_row():
+    first = {'columnHeader': {'dimensions': ['ga:date']}, 'data': {'rows': [1, 2], 'totals': [3], 'rowCount': 2}}
+    second = {'columnHeader': {'dimensions': ['ga:date']}, 'data': {'rows': [3]}}
+    merged = merge_reports([{}, first, {}, second])
+    assert merged['columnHeader'] == {'dimensions': ['ga:date']}
+    assert merged['data'] == {'rows': [1, 2, 3], 'rowCount': 3}
+    assert merge_reports([{}, {}]) == {}
+
+
+def test_get_analytics_report_accepts_an_int_view_id(ga_hook):
+    report = ga_hook.get_analytics_report(12345, **report_args())
+    assert [body['reportRequests'][0]['viewId'] for body in ga_hook.reports.bodies] == ['12345', '12345']
+    assert report['viewId'] == '12345'
+    assert [row['metrics'][0]['values'] for row in report['data']['rows']] == [['12345-0'], ['12345-1'],
+                                                                                ['12345-2']]
+
+
+def test_get_analytics_report_merges_int_views_in_order(ga_hook):
+    report = ga_hook.get_analytics_report([2, 1], **report_args(until='2020-01-02', date_slice='day'))
+    assert report['columnHeader']['dimensions'] == ['viewId', 'ga:date']
+    expected = []
+    for view in ('2', '1'):
+        for day in ('2020-01-01', '2020-01-02'):
+            expected += [[view, day]] * 3
+    assert [row['dimensions'] for row in report['data']['rows']] == expected
+    # Slices have their own dateRanges, so every report is a batch of its own, fetched in 2 pages.
+    assert len(ga_hook.reports.bodies) == 8
+
+
+def test_iter_report_pages_streams_typed_pages(ga_hook):
+    pages = list(ga_hook.iter_report_pages(12345, **report_args()))
+    assert [dict(page) for page in pages] == [
+        {'ga:date': ['2020-01-01', '2020-01-01'], 'ga:sessions': ['12345-0', '12345-1']},
+        {'ga:date': ['2020-01-01'], 'ga:sessions': ['12345-2']}]
+    assert pages[0].metric_types == {'ga:sessions': 'INTEGER'}
+
+
+def test_token_bucket_allows_a_burst_then_paces_requests(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() == 0.5
+    assert bucket.acquire() == 0.5
+    assert clock.sleeps == [0.5, 0.5]
+    # Idle time refills the bucket, never above burst.
+    clock.now += 10
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() == 0.5
+
+
+def test_is_retryable():
+    for status in (429, 500, 503):
+        assert is_retryable(http_error(status))
+    assert is_retryable(http_error(403, b'{"error": {"errors": [{"reason": "userRateLimitExceeded"}]}}'))
+    assert is_retryable(http_error(403, b'{"error": {"status": "RESOURCE_EXHAUSTED"}}'))
+    assert not is_retryable(http_error(403, b'{"error": {"status": "PERMISSION_DENIED"}}'))
+    assert not is_retryable(http_error(400))
+
+
+def test_execute_request_backs_off_on_quota_errors(clock, ga_hook):
+    request = FailingRequest([http_error(429), http_error(503), http_error(500)], response={'reports': []})
+    assert ga_hook.execute_request(request, 'backoff_view') == {'reports': []}
+    assert request.calls == 4
+    # 2 ** attempt seconds plus jitter.
+    assert clock.sleeps == [1.5, 2.5, 4.5]
+    assert ga_hook.throttled == pytest.approx(8.5)
+
+
+def test_execute_request_gives_up_after_max_retries(clock, ga_hook):
+    ga_hook.max_retries = 2
+    request = FailingRequest([http_error(429)] * 3)
+    with pytest.raises(HttpError):
+        ga_hook.execute_request(request, 'retries_view')
+    assert request.calls == 3
+
+
+def test_execute_request_raises_other_errors_at_once(clock, ga_hook):
+    request = FailingRequest([http_error(400)])
+    with pytest.raises(HttpError):
+        ga_hook.execute_request(request, 'invalid_view')
+    assert request.calls == 1 and clock.sleeps == []
@@ -0,0 +1,164 @@
+import types
+
+import pandas as pd
+import pytest
+
+from google_analytics_plugin.hooks.mysql_hook import MySqlHook
+
+
+class FakeCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, parameters=None):
+        self.conn.statements.append(sql)
+        if sql.startswith('LOAD DATA'):
+            # The server reads the whole pipe, then reports its warnings.
+            with open(parameters[0]) as pipe:
+                self.conn.loaded = pipe.read()
+            self.conn.warnings = list(self.conn.server_warnings(sql))
+
+    def executemany(self, sql, rows):
+        self.conn.statements.append(sql)
+        self.conn.inserted.extend(rows)
+
+    def fetchall(self):
+        return self.conn.warnings
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def __init__(self, server_warnings):
+        self.server_warnings = server_warnings
+        self.statements = []
+        self.warnings = []
+        self.loaded = None
+        self.inserted = []
+        self.committed = False
+        self.rolled_back = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def warning_count(self):
+        return len(self.warnings)
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def invalidate(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def mysql8_warnings(sql):
+    """Warnings of MySQL 8.0 for the utf8 alias."""
+    if 'CHARACTER SET utf8 ' in sql:
+        yield ('Warning', 1287, "'utf8' is deprecated and will be removed in a future release.")
+        yield ('Warning', 3719, "'utf8' is currently an alias for the character set UTF8MB3.")
+
+
+def make_hook(conn, extras=None):
+    hook = MySqlHook(mysql_conn_id='test_mysql')
+    hook.get_connection = lambda conn_id: types.SimpleNamespace(extra_dejson=extras or {})
+    hook.get_sqlalchemy_engine = lambda *args, **kwargs: types.SimpleNamespace(raw_connection=lambda: conn)
+    return hook
+
+
+def test_load_rows_default_charset_passes_warning_check():
+    conn = FakeConnection(mysql8_warnings)
+    rows = make_hook(conn).load_rows('target', [pd.DataFrame({'id': [1, 2], 'name': ['a', None]})])
+    assert rows == 2
+    assert 'CHARACTER SET utf8mb4 ' in conn.statements[0]
+    assert conn.loaded == '1\ta\n2\t\\N\n'
+    assert conn.committed
+
+
+def test_load_rows_utf8_extra_is_read_as_utf8mb4():
+    conn = FakeConnection(mysql8_warnings)
+    make_hook(conn, {'charset': 'utf-8'}).load_rows('target', [[(1, 'a')]])
+    assert 'CHARACTER SET utf8mb4 ' in conn.statements[0]
+    assert conn.committed
+
+
+def test_load_rows_skips_deprecation_warnings():
+    conn = FakeConnection(lambda sql: [('Warning', 1287, 'deprecated syntax'), ('Note', 1265, 'note')])
+    assert make_hook(conn).load_rows('target', [[(1, 'a')]]) == 1
+    assert conn.committed
+
+
+def test_load_rows_raises_on_data_warnings():
+    conn = FakeConnection(lambda sql: [('Warning', 1265, "Data truncated for column 'id' at row 1")])
+    with pytest.raises(ValueError, match='Data truncated'):
+        make_hook(conn).load_rows('target', [[('x', 'a')]])
+    assert conn.rolled_back and not conn.committed
+
+
+def test_merge_frames_stages_without_keys_and_merges_in_load_order():
+    conn = FakeConnection(lambda sql: [])
+    hook = make_hook(conn)
+    hook.prepare_merge_target = lambda *args, **kwargs: None
+    frames = [pd.DataFrame({'id': [1], 'v': ['x']}), pd.DataFrame({'id': [1], 'v': ['y']})]
+    assert hook.merge_frames(frames, 'target', ['id']) == 2
+
+    create, merge = conn.statements[0], conn.statements[-2]
+    # A repeated key must reach the merge instead of failing on a staging key.
+    assert create.startswith('CREATE TEMPORARY TABLE `_merge_target` (`_merge_seq` BIGINT NOT NULL AUTO_INCREMENT')
+    assert 'SELECT `id`, `v` FROM `target` LIMIT 0' in create and ' LIKE ' not in create
+    assert conn.inserted == [(1, 'x'), (1, 'y')]
+    assert merge == ('INSERT INTO `target` (`id`, `v`) SELECT new.`id`, new.`v` FROM `_merge_target` AS new '
+                     'ORDER BY new.`_merge_seq` ON DUPLICATE KEY UPDATE `v` = new.`v`')
+    assert conn.committed
+
+
+def split_hook(values):
+    """MySqlHook answering the split queries from a sorted list of column values."""
+    hook = MySqlHook(mysql_conn_id='test_mysql')
+
+    def get_first(sql, parameters=None):
+        if sql.startswith('SELECT MIN('):
+            return (values[0], values[-1]) if values else (None, None)
+        if sql.startswith('SELECT COUNT('):
+            return (len(values), )
+        return (values[parameters[0]], )
+    hook.get_first = get_first
+    return hook
+
+
+def covered(ranges, values):
+    """Number of ranges holding every value, which must be exactly one each."""
+    return [sum(1 for lower, upper in ranges
+                if (lower is None or value >= lower) and (upper is None or value < upper)) for value in values]
+
+
+def test_split_ranges_of_integers_are_even_and_cover_every_row():
+    values = list(range(1, 101))
+    ranges = split_hook(values).get_split_ranges('t', 'id', 4)
+    assert ranges == [(None, 25), (25, 50), (50, 75), (75, None)]
+    assert covered(ranges, values) == [1] * len(values)
+
+
+def test_split_ranges_of_text_follow_quantiles():
+    values = sorted('abcdefghij')
+    ranges = split_hook(values).get_split_ranges('t', 'code', 3)
+    assert ranges == [(None, 'd'), ('d', 'g'), ('g', None)]
+    assert covered(ranges, values) == [1] * len(values)
+
+
+def test_split_ranges_drop_duplicate_bounds():
+    # 8 ranges of 1..4 repeat the bounds 2 and 3.
+    ranges = split_hook([1, 2, 3, 4]).get_split_ranges('t', 'id', 8)
+    assert ranges == [(None, 2), (2, 3), (3, None)]
+
+
+def test_split_ranges_of_an_empty_or_constant_column():
+    assert split_hook([]).get_split_ranges('t', 'id', 4) == [(None, None)]
+    assert split_hook([7, 7]).get_split_ranges('t', 'id', 4) == [(None, None)]
+    assert split_hook([1, 5]).get_split_ranges('t', 'id', 1) == [(None, None)]
@@ -0,0 +1,68 @@
+import tracemalloc
+import types
+
+import pytest
+
+from google_analytics_plugin.operators import profiling
+from google_analytics_plugin.operators.profiling import ExecuteProfiler, profile_settings
+
+
+class FakeOperator(object):
+    def __init__(self, params=None, **conn_ids):
+        self.params = params
+        self.__dict__.update(conn_ids)
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """Connection extras by conn id, recording every lookup."""
+    lookups = []
+    extras = {'profiled_mysql': {'profile': 'cpu,memory', 'profile_overhead': 0.05}, 'plain_mysql': {}}
+
+    def get_connection(conn_id):
+        lookups.append(conn_id)
+        return types.SimpleNamespace(extra_dejson=extras[conn_id])
+    monkeypatch.setattr(profiling.BaseHook, 'get_connection', staticmethod(get_connection))
+    monkeypatch.delenv('AIRFLOW_PROFILE_CONN_IDS', raising=False)
+    return lookups
+
+
+def test_profiling_off_reads_no_connection(connections):
+    operator = FakeOperator(mysql_conn_id='profiled_mysql', psql_conn_id='plain_mysql')
+    assert profile_settings(operator) == (set(), profiling.DEFAULT_OVERHEAD)
+    assert connections == []
+
+
+def test_params_are_checked_before_connections(connections, monkeypatch):
+    monkeypatch.setenv('AIRFLOW_PROFILE_CONN_IDS', 'profiled_mysql')
+    operator = FakeOperator(params={'profile': True}, mysql_conn_id='profiled_mysql')
+    assert profile_settings(operator) == ({'cpu'}, profiling.DEFAULT_OVERHEAD)
+    assert connections == []
+
+
+def test_only_opted_in_connections_are_read(connections, monkeypatch):
+    monkeypatch.setenv('AIRFLOW_PROFILE_CONN_IDS', 'profiled_mysql, other')
+    operator = FakeOperator(params={}, mysql_conn_id_from='plain_mysql', mysql_conn_id_to='profiled_mysql')
+    assert profile_settings(operator) == ({'cpu', 'memory'}, 0.05)
+    assert connections == ['profiled_mysql']
+
+
+def test_memory_profile_leaves_outside_tracing_running():
+    operator = types.SimpleNamespace(log=types.SimpleNamespace(info=lambda *args: None))
+    written = {}
+    profiler = ExecuteProfiler(operator, {}, {'memory'}, profiling.DEFAULT_OVERHEAD)
+    profiler.write = lambda suffix, text: written.setdefault(suffix, text)
+
+    tracemalloc.start()
+    try:
+        with profiler:
+            pass
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+    assert 'memory.txt' in written
+
+    with ExecuteProfiler(operator, {}, {'memory'}, profiling.DEFAULT_OVERHEAD) as own:
+        own.write = lambda suffix, text: None
+        assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
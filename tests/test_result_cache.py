@@ -0,0 +1,82 @@
+import os
+import stat
+
+import pytest
+
+from google_analytics_plugin.hooks import result_cache
+from google_analytics_plugin.hooks.result_cache import ResultCache, cached_query, normalize_sql, referenced_tables
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / 'cache'), max_bytes=1024 * 1024)
+
+
+def test_cache_directory_is_private(tmp_path):
+    directory = str(tmp_path / 'cache')
+    ResultCache(directory)
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+    os.chmod(directory, 0o777)
+    with pytest.raises(ValueError, match='writable by other users'):
+        ResultCache(directory)
+
+
+def test_key_ignores_formatting():
+    assert normalize_sql(' SELECT *\n  FROM t ;') == 'SELECT * FROM t'
+    assert referenced_tables('SELECT * FROM `db`.`a` JOIN b ON a.id = b.id') == ['a', 'b']
+
+
+def test_get_returns_live_entries(cache):
+    key = cache.key('conn', 'db', 'SELECT 1', (1, ))
+    assert cache.get(key) == (False, None)
+    cache.set(key, [(1, 'a')], ttl=60)
+    assert cache.get(key) == (True, [(1, 'a')])
+    assert cache.key('conn', 'db', 'SELECT  1;', (1, )) == key
+    assert cache.key('conn', 'db', 'SELECT 1', (2, )) != key
+
+
+def test_get_removes_expired_entries(cache, monkeypatch):
+    key = cache.key('conn', 'db', 'SELECT 1')
+    cache.set(key, 'value', ttl=10)
+    now = result_cache.time.time()
+    monkeypatch.setattr(result_cache.time, 'time', lambda: now + 11)
+    assert cache.get(key) == (False, None)
+    assert not os.path.exists(cache.path(key))
+
+
+def test_evict_removes_least_recently_used_first(cache):
+    value = 'x' * 1000
+    for age, key in enumerate(['new', 'used', 'old']):
+        cache.set(key, value, ttl=60)
+        os.utime(cache.path(key), (1000 - age, 1000 - age))
+    # A hit refreshes the entry.
+    cache.get('used')
+    cache.max_bytes = os.path.getsize(cache.path('new')) + os.path.getsize(cache.path('used'))
+    cache.evict()
+    assert sorted(os.path.basename(path) for path in cache._entries()) == ['new.result', 'used.result']
+
+
+def test_invalidate_removes_entries_read_from_tables(cache):
+    cache.set('a', 1, ttl=60, tables=referenced_tables('SELECT * FROM a'))
+    cache.set('ab', 2, ttl=60, tables=referenced_tables('SELECT * FROM a JOIN b USING (id)'))
+    cache.set('c', 3, ttl=60, tables=referenced_tables('SELECT * FROM c'))
+    assert cache.invalidate('`db`.`A`') == 2
+    assert cache.get('a')[0] is False and cache.get('ab')[0] is False
+    assert cache.get('c') == (True, 3)
+
+
+def test_cached_query_computes_once(tmp_path, monkeypatch):
+    monkeypatch.setenv('AIRFLOW_RESULT_CACHE_DIR', str(tmp_path / 'cache'))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    assert cached_query('conn', 'db', 'SELECT * FROM t', None, 60, compute) == 1
+    assert cached_query('conn', 'db', 'SELECT * FROM t', None, 60, compute) == 1
+    # No ttl bypasses the cache.
+    assert cached_query('conn', 'db', 'SELECT * FROM t', None, None, compute) == 2
+    assert result_cache.invalidate_tables('t') == 1
+    assert cached_query('conn', 'db', 'SELECT * FROM t', None, 60, compute) == 3
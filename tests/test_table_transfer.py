@@ -0,0 +1,237 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from google_analytics_plugin.operators import table_transfer
+from google_analytics_plugin.operators.table_transfer import ChunkPipeline, TableTransfer
+
+
+class FakeVariables(object):
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key, default_var=None, deserialize_json=False):
+        return self.values.get(key, default_var)
+
+    def set(self, key, value, serialize_json=False):
+        self.values[key] = value
+
+
+def matching(frame, where, parameters):
+    """Rows of frame selected by a range_condition on id."""
+    ids = frame['id']
+    if '< %s OR' in where:
+        return frame[ids < parameters[0]]
+    if '>= %s AND' in where:
+        return frame[(ids >= parameters[0]) & (ids < parameters[1])]
+    if '>= %s' in where:
+        return frame[ids >= parameters[0]]
+    return frame
+
+
+def checksum(frame):
+    return len(frame), hash(tuple(map(tuple, frame.values.tolist())))
+
+
+class FakeSource(object):
+    """MySqlHook serving the rows of a frame, chunk_rows at a time."""
+
+    def __init__(self, frame, split_ranges=None):
+        self.frame = frame
+        self.split_ranges = split_ranges
+        self.queries = []
+
+    def get_first(self, sql, parameters=None):
+        return (self.frame['id'].max() if len(self.frame) else None, )
+
+    def get_columns(self, table):
+        return list(self.frame.columns)
+
+    def get_split_ranges(self, table, column, num_ranges):
+        return self.split_ranges
+
+    def get_checksum(self, table, columns, where='1 = 1', parameters=None):
+        return checksum(matching(self.frame, where, parameters))
+
+    def iter_chunks(self, query, chunk_rows, parameters=None, as_frame=True):
+        self.queries.append((query, parameters))
+        rows = self.frame
+        if ' > %s and ' in query:
+            rows = rows[(rows['id'] > parameters[0]) & (rows['id'] <= parameters[1])]
+        elif ' <= %s' in query:
+            rows = rows[rows['id'] <= parameters[0]]
+        elif ' where ' in query:
+            rows = matching(rows, query.split(' where ', 1)[1], parameters)
+        for start in range(0, max(len(rows), 1), chunk_rows):
+            yield rows.iloc[start:start + chunk_rows]
+
+
+class FakeTarget(object):
+    """Loader recording the frames of every load_frames call, into frame when it is set."""
+
+    quote_identifier = staticmethod(table_transfer._quote_ident)
+
+    def __init__(self, fail=False, frame=None):
+        self.loads = []
+        self.fail = fail
+        self.frame = frame
+        self.deleted = []
+
+    def has_table(self, table):
+        return self.frame is not None
+
+    def get_checksum(self, table, columns, where='1 = 1', parameters=None):
+        return checksum(matching(self.frame, where, parameters))
+
+    def run(self, sql, parameters=None):
+        assert sql.startswith('DELETE FROM dst WHERE ')
+        deleted = matching(self.frame, sql, parameters)
+        self.deleted.append(list(deleted['id']))
+        self.frame = self.frame.drop(deleted.index)
+
+    def load_frames(self, frames, table, if_exists='append', load_method='insert', merge_keys=None):
+        frames = list(frames)
+        if self.fail:
+            raise ValueError('load failed')
+        self.loads.append((if_exists, frames))
+        if self.frame is not None:
+            self.frame = pd.concat([self.frame] + frames, ignore_index=True)
+        return sum(len(frame) for frame in frames)
+
+
+@pytest.fixture
+def variables(monkeypatch):
+    fake = FakeVariables()
+    monkeypatch.setattr(table_transfer, 'Variable', fake)
+    return fake
+
+
+def loaded_ids(target):
+    return [list(frame['id']) for if_exists, frames in target.loads for frame in frames]
+
+
+def test_pipeline_keeps_the_order_of_a_single_stream():
+    pipeline = ChunkPipeline(queue_depth=2, readers=1, writers=1)
+    reader = threading.Thread(target=pipeline.read, args=(iter(range(20)), ))
+    reader.start()
+    assert list(pipeline.consume()) == list(range(20))
+    reader.join()
+
+
+def test_pipeline_ends_every_writer_after_the_last_reader():
+    pipeline = ChunkPipeline(queue_depth=1, readers=2, writers=3)
+    consumed = []
+    writers = [threading.Thread(target=lambda: consumed.extend(pipeline.consume())) for _ in range(3)]
+    for writer in writers:
+        writer.start()
+    readers = [threading.Thread(target=pipeline.read, args=(iter(range(start, start + 5)), ))
+               for start in (0, 5)]
+    for reader in readers:
+        reader.start()
+    for thread in readers + writers:
+        thread.join(5)
+        assert not thread.is_alive()
+    assert sorted(consumed) == list(range(10))
+
+
+def test_pipeline_raises_reader_errors_in_writers():
+    def failing():
+        yield 1
+        raise IOError('extract failed')
+
+    pipeline = ChunkPipeline(queue_depth=4, readers=1, writers=1)
+    pipeline.read(failing())
+    chunks = pipeline.consume()
+    assert next(chunks) == 1
+    with pytest.raises(IOError, match='extract failed'):
+        next(chunks)
+
+
+def test_pipeline_stop_unblocks_readers():
+    pipeline = ChunkPipeline(queue_depth=1, readers=1, writers=1)
+    pipeline.poll_interval = 0.01
+    reader = threading.Thread(target=pipeline.read, args=(iter(range(100)), ))
+    reader.start()
+    pipeline.stop(ValueError('load failed'))
+    reader.join(5)
+    assert not reader.is_alive()
+    with pytest.raises(ValueError, match='load failed'):
+        list(pipeline.consume())
+
+
+def test_transfer_creates_the_target_from_the_first_chunk():
+    source = FakeSource(pd.DataFrame({'id': range(1, 8)}))
+    target = FakeTarget()
+    transfer = TableTransfer(source, target, 'src', 'dst', if_exists='replace', chunk_rows=3)
+    assert transfer.run() == 7
+    assert [if_exists for if_exists, frames in target.loads] == ['replace']
+    assert loaded_ids(target) == [[1, 2, 3], [4, 5, 6], [7]]
+
+
+def test_incremental_transfer_advances_the_watermark(variables):
+    source = FakeSource(pd.DataFrame({'id': [1, 2]}))
+    target = FakeTarget()
+    transfer = TableTransfer(source, target, 'src', 'dst', if_exists='replace',
+                             incremental_column='id', watermark_key='dst_mark')
+    assert transfer.run() == 2
+    assert variables.values['dst_mark'] == {'column': 'id', 'value': 2}
+    assert target.loads[0][0] == 'replace'
+
+    source.frame = pd.DataFrame({'id': [1, 2, 3, 4]})
+    transfer = TableTransfer(source, target, 'src', 'dst', if_exists='replace',
+                             incremental_column='id', watermark_key='dst_mark')
+    assert transfer.run() == 2
+    assert source.queries[-1][1] == (2, 4)
+    assert target.loads[-1][0] == 'append'
+    assert loaded_ids(target)[-1] == [3, 4]
+    assert variables.values['dst_mark'] == {'column': 'id', 'value': 4}
+
+
+def test_incremental_transfer_keeps_the_watermark_when_the_load_fails(variables):
+    variables.set('dst_mark', {'column': 'id', 'value': 1})
+    transfer = TableTransfer(FakeSource(pd.DataFrame({'id': [1, 2, 3]})), FakeTarget(fail=True), 'src', 'dst',
+                             incremental_column='id', watermark_key='dst_mark')
+    with pytest.raises(ValueError, match='load failed'):
+        transfer.run()
+    assert variables.values['dst_mark'] == {'column': 'id', 'value': 1}
+
+
+def test_incremental_transfer_ignores_a_mark_of_another_column(variables):
+    variables.set('dst_mark', {'column': 'updated_at', 'value': '2020-01-01'})
+    source = FakeSource(pd.DataFrame({'id': [1, 2]}))
+    transfer = TableTransfer(source, FakeTarget(), 'src', 'dst', incremental_column='id', watermark_key='dst_mark')
+    assert transfer.run() == 2
+    assert source.queries[-1][1] == (2, )
+
+
+def test_changed_chunks_are_replaced():
+    source = pd.DataFrame({'id': range(1, 10), 'v': ['a'] * 9})
+    stale = source[source['id'] != 8].copy()
+    stale.loc[stale['id'] == 5, 'v'] = 'b'
+    target = FakeTarget(frame=stale)
+    transfer = TableTransfer(FakeSource(source, split_ranges=[(None, 4), (4, 7), (7, None)]), target, 'src', 'dst',
+                             split_column='id', checksum_chunks=3)
+    assert transfer.run() == 6
+    # The first range matches and is left alone.
+    assert target.deleted == [[4, 5, 6], [7, 9]]
+    assert [if_exists for if_exists, frames in target.loads] == ['append', 'append']
+    synced = target.frame.sort_values('id').reset_index(drop=True)
+    assert synced.equals(source)
+
+
+def test_unchanged_target_is_not_copied():
+    source = pd.DataFrame({'id': range(1, 10), 'v': ['a'] * 9})
+    target = FakeTarget(frame=source.copy())
+    transfer = TableTransfer(FakeSource(source, split_ranges=[(None, 5), (5, None)]), target, 'src', 'dst',
+                             split_column='id', checksum_chunks=2)
+    assert transfer.run() == 0
+    assert target.loads == [] and target.deleted == []
+
+
+def test_checksum_transfer_of_a_missing_target_is_full():
+    target = FakeTarget()
+    transfer = TableTransfer(FakeSource(pd.DataFrame({'id': [1, 2, 3]})), target, 'src', 'dst',
+                             if_exists='replace', checksum_chunks=4)
+    assert transfer.run() == 3
+    assert [if_exists for if_exists, frames in target.loads] == ['replace']
@@ -0,0 +1,20 @@
+import pandas as pd
+import pyarrow as pa
+
+from google_analytics_plugin.operators.task_metrics import chunk_size
+
+
+def test_chunk_size_of_a_frame_is_shallow():
+    frame = pd.DataFrame({'id': [1, 2, 3], 'name': pd.Series(['a' * 1000, 'b', None], dtype=object)})
+    rows, size = chunk_size(frame)
+    assert rows == 3
+    assert size == frame.memory_usage(index=False, deep=False).sum()
+    assert size < frame.memory_usage(index=False, deep=True).sum()
+
+
+def test_chunk_size_of_other_chunks():
+    batch = pa.RecordBatch.from_pydict({'id': [1, 2]})
+    assert chunk_size(batch) == (2, batch.nbytes)
+    assert chunk_size({'id': [1, 2, 3]}) == (3, 0)
+    assert chunk_size({}) == (0, 0)
+    assert chunk_size([(1, 'a')]) == (1, 0)
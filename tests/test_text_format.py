@@ -0,0 +1,54 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from google_analytics_plugin.hooks.text_format import NULL, TextRowStream, format_value
+
+
+def test_format_value_nulls():
+    assert format_value(None) == NULL
+    assert format_value(float('nan')) == NULL
+    assert format_value(pd.NaT) == NULL
+
+
+def test_format_value_escapes_strings():
+    assert format_value('a\tb\nc\\d') == 'a\\tb\\nc\\\\d'
+
+
+def test_format_value_integral_floats_have_no_fraction():
+    assert format_value(1.0) == '1'
+    assert format_value(np.float64(-42.0)) == '-42'
+    assert format_value(2.5) == '2.5'
+
+
+def test_format_value_timedelta_as_nanoseconds():
+    assert format_value(pd.Timedelta(hours=1)) == str(3600 * 10 ** 9)
+    # Raw cursor rows keep the server's TIME text.
+    assert format_value(datetime.timedelta(hours=1)) == '1:00:00'
+
+
+def test_format_value_bools_and_bytes():
+    assert format_value(True) == 't'
+    assert format_value(False, false='0') == '0'
+    assert format_value(b'\x01') == '\\\\x01'
+
+
+def test_text_row_stream_nullable_integer_column():
+    # from_records turns an integer column holding a NULL into float64.
+    frame = pd.DataFrame.from_records([(1, 'a'), (None, 'b')], columns=['id', 'name'])
+    stream = TextRowStream([frame, [], [(3, None)]])
+    assert stream.read() == '1\ta\n\\N\tb\n3\t\\N\n'
+    assert stream.rows == 3
+
+
+def test_text_row_stream_reads_in_pieces():
+    stream = TextRowStream([[(index, 'x' * 10)] for index in range(50)])
+    expected = ''.join('{0}\t{1}\n'.format(index, 'x' * 10) for index in range(50))
+    pieces = []
+    while True:
+        piece = stream.read(7)
+        if not piece:
+            break
+        pieces.append(piece)
+    assert ''.join(pieces) == expected